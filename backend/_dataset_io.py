@@ -0,0 +1,49 @@
+"""
+File helpers shared by the CrowdHuman dataset preparation scripts
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import List, Tuple
+
+# Workers for staging images; links and copies wait on the filesystem, not the CPU
+COPY_WORKERS = (os.cpu_count() or 1) * 2
+
+def list_files(directory: Path, suffixes: Tuple[str, ...], limit: int = None) -> List[Path]:
+    """Files in directory with one of the suffixes, from a single scandir pass that stops once limit
+    files are found; grouped by suffix in the order given. Missing directories give []"""
+    by_suffix = {suffix: [] for suffix in suffixes}
+    found = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if limit is not None and found >= limit:
+                    break
+                suffix = os.path.splitext(entry.name)[1]
+                if suffix in by_suffix and entry.is_file():
+                    by_suffix[suffix].append(Path(entry.path))
+                    found += 1
+    except FileNotFoundError:
+        return []
+    return [path for suffix in suffixes for path in by_suffix[suffix]]
+
+def count_lines(path: Path) -> int:
+    """Number of lines in a small text file, counted on the raw buffer without splitting or decoding"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+
+def fast_link(src: Path, dst: Path):
+    """Hardlink src to dst (no data copied); falls back to a real copy across filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def copy_and_write_labels(img_path: Path, dest_img_path: Path, label_file: Path, labels: List[Tuple[int, float, float, float, float]]):
+    """Stage one image into the dataset and write its YOLO label file in a single write"""
+    fast_link(img_path, dest_img_path)
+    body = "".join(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in labels)
+    with open(label_file, 'w') as f:
+        f.write(body)
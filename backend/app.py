@@ -1,7 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, send_from_directory
+from werkzeug.security import safe_join
 from flask_cors import CORS
-import base64
+try:
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+import asyncio
+import datetime as _dt
+import json
+import mimetypes
 import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import msgspec
+import orjson
+
+# Must be set before cv2/torch are imported so compiled kernels are cached across restarts
+os.environ.setdefault("CUDA_MODULE_LOADING", "LAZY")
+os.environ.setdefault("OPENCV_OPENCL_CACHE_ENABLE", "1")
+
+import cv2
+import numpy as np
 
 from config import load_config
 from detections.head_pose import infer_head_pose
@@ -12,6 +35,153 @@ from alerts.twilio_client import send_whatsapp_alert
 from detections import head_pose_model as hpm
 
 
+def _make_warmup_jpeg() -> bytes:
+    """Encode a tiny black JPEG once, used to trigger model init during warmup"""
+    try:
+        ok, buf = cv2.imencode('.jpg', np.zeros((64, 64, 3), np.uint8))
+        if ok:
+            return buf.tobytes()
+    except Exception:
+        pass
+    try:
+        import io
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new('RGB', (64, 64), (0, 0, 0)).save(buf, format='JPEG')
+        return buf.getvalue()
+    except Exception:
+        return b""
+
+
+_WARMUP_JPEG = _make_warmup_jpeg()
+# The same frame decoded; arrays have no result-cache key, so every warmup pass reaches the model
+_WARMUP_FRAME = np.zeros((64, 64, 3), np.uint8)
+
+
+class Payload(msgspec.Struct):
+    """Body of the /api/detections/* requests"""
+    image_b64: str = ""
+    user_id: Any = None
+
+
+def _parse_payload() -> Payload:
+    """Decode the request body straight from bytes; malformed bodies yield an empty payload"""
+    try:
+        return msgspec.json.decode(request.get_data(cache=False), type=Payload)
+    except msgspec.DecodeError:
+        return Payload()
+
+
+def _strip_data_url(s: str) -> str:
+    """Drop a "data:image/...;base64," prefix; only the header region is searched"""
+    i = s.find(",", 0, 128)
+    return s[i + 1:] if i >= 0 else s
+
+
+def _decode_bytes(raw: bytes) -> np.ndarray:
+    """Decode an encoded image once into a BGR frame for all detectors"""
+    image = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("could not decode image")
+    return image
+
+
+def _decode_image(image_b64: str) -> np.ndarray:
+    """Decode a base64 (optionally data-URL) image once into a BGR frame for all detectors"""
+    return _decode_bytes(_b64.b64decode(_strip_data_url(image_b64), validate=False))
+
+
+def _read_frame():
+    """(image, user_id, error_response) for a detection request.
+
+    JSON bodies carry a base64 image_b64; with ?raw=1 or an application/octet-stream body the
+    request body is the encoded image itself and user_id comes from the query string.
+    """
+    if request.args.get("raw") == "1" or request.mimetype == "application/octet-stream":
+        user_id = request.args.get("user_id")
+        data = request.get_data(cache=False)
+        if not data:
+            return None, user_id, (_json({"error": "image body required"}), 400)
+        try:
+            return _decode_bytes(data), user_id, None
+        except Exception:
+            return None, user_id, (_json({"error": "invalid image"}), 400)
+
+    payload = _parse_payload()
+    if not payload.image_b64:
+        return None, payload.user_id, (_json({"error": "image_b64 required"}), 400)
+    try:
+        return _decode_image(payload.image_b64), payload.user_id, None
+    except Exception:
+        return None, payload.user_id, (_json({"error": "invalid base64 image"}), 400)
+
+
+def _json(obj):
+    """Serialize obj with orjson (numpy scalars and arrays included) into a JSON response"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
+
+# How long a built status body is reused before the Flask handler rebuilds it
+_STATUS_TTL = 0.5
+
+# Read once at import instead of per /api/alerts request
+_TWILIO_TO = os.environ.get("TWILIO_WHATSAPP_TO", "")
+
+# Pre-encoded bodies for the fixed endpoints, returned as raw Flask Responses
+_HEALTH_JSON = json.dumps({"status": "ok"}).encode()
+_READY_JSON = json.dumps({"ready": True}).encode()
+_NOT_READY_JSON = json.dumps({"ready": False}).encode()
+_API_INDEX_JSON = json.dumps({
+    "message": "AI Exam Monitor API",
+    "health": "/api/health",
+    "endpoints": [
+        "/api/ready",
+        "/api/detections/head_pose",
+        "/api/detections/multi_person",
+        "/api/detections/body_visibility",
+        "/api/detections/unified",
+        "/api/system/status",
+        "/api/alert",
+    ],
+    "frontend": "Static frontend served at /",
+}).encode()
+
+
+# Small hot frontend assets are kept in memory, keyed by path and invalidated on mtime change
+_STATIC_CACHE_MAX_FILES = 64
+_STATIC_CACHE_MAX_BYTES = 1 << 20
+_static_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_static_cache_lock = threading.Lock()
+
+
+def _load_static(file_path: str):
+    """Return (data, content_type, etag) for a cacheable static file, else None"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode) or st.st_size > _STATIC_CACHE_MAX_BYTES:
+        return None
+
+    with _static_cache_lock:
+        entry = _static_cache.get(file_path)
+        if entry is not None and entry[0] == st.st_mtime_ns:
+            _static_cache.move_to_end(file_path)
+            return entry[1:]
+
+    with open(file_path, "rb") as f:
+        data = f.read()
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    with _static_cache_lock:
+        _static_cache[file_path] = (st.st_mtime_ns, data, content_type, etag)
+        _static_cache.move_to_end(file_path)
+        while len(_static_cache) > _STATIC_CACHE_MAX_FILES:
+            _static_cache.popitem(last=False)
+    return data, content_type, etag
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
     CORS(app)
@@ -19,47 +189,49 @@ def create_app() -> Flask:
     cfg = load_config()
     app.config.update(cfg)
 
+    # Set once the first warmup pass has finished; gates /api/ready
+    models_ready = threading.Event()
+
     # Background warmup to avoid first-request stalls
     def _background_warmup():
         try:
             from detections.unified_detection import get_unified_system
             from detections import head_pose_model as hpm
-            import io
-            from PIL import Image
             sys = get_unified_system()
-            # Tiny black image to trigger model init
-            img = Image.new('RGB', (64, 64), (0, 0, 0))
-            buf = io.BytesIO(); img.save(buf, format='JPEG'); img_bytes = buf.getvalue()
             # Load head pose model if available
             hpm._load_model_if_available()
-            # Trigger multi-person model load
-            sys.detect_multiple_persons(img_bytes)
+            # A few passes over every detection path so first-call kernel
+            # compilation and allocator growth settle before real traffic
+            for _ in range(3):
+                sys.detect_multiple_persons(_WARMUP_JPEG)
+                infer_head_pose(_WARMUP_FRAME)
+                infer_body_visibility(_WARMUP_JPEG)
+                infer_unified(_WARMUP_JPEG)
             print("Warmup complete")
+            print("Model status:", get_system_status())
         except Exception as e:
             print("Warmup failed:", str(e))
+        finally:
+            # Detectors fall back to simpler methods, so serve traffic even if warmup failed
+            models_ready.set()
     try:
-        import threading
         threading.Thread(target=_background_warmup, daemon=True).start()
     except Exception as _:
         pass
 
-    # Load models on startup to check for errors
-    print("Starting model loading...")
-    try:
-        from detections.unified_detection import get_system_status
-        status = get_system_status()
-        print("Model status:", status)
-    except Exception as e:
-        print("Model loading error on startup:", str(e))
-
     @app.get("/api/health")
     def health():
-        return {"status": "ok"}
+        return app.response_class(_HEALTH_JSON, mimetype="application/json")
+
+    @app.get("/api/ready")
+    def ready():
+        if models_ready.is_set():
+            return app.response_class(_READY_JSON, mimetype="application/json")
+        return app.response_class(_NOT_READY_JSON, status=503, mimetype="application/json")
 
     @app.post("/api/warmup")
     def api_warmup():
         try:
-            import threading
             threading.Thread(target=_background_warmup, daemon=True).start()
             return {"started": True}
         except Exception as e:
@@ -67,43 +239,24 @@ def create_app() -> Flask:
 
     @app.get("/api")
     def api_index():
-        return jsonify({
-            "message": "AI Exam Monitor API",
-            "health": "/api/health",
-            "endpoints": [
-                "/api/detections/head_pose",
-                "/api/detections/multi_person",
-                "/api/detections/body_visibility",
-                "/api/detections/unified",
-                "/api/system/status",
-                "/api/alert",
-            ],
-            "frontend": "Static frontend served at /",
-        })
+        return app.response_class(_API_INDEX_JSON, mimetype="application/json")
 
     @app.post("/api/detections/head_pose")
-    def head_pose_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+    async def head_pose_detection():
+        image, user_id, error = _read_frame()
+        if error:
+            return error
 
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
-
-        result = infer_head_pose(image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await asyncio.to_thread(infer_head_pose, image, user_id=user_id)
+        result["user_id"] = user_id
+        return _json(result)
 
     @app.get("/api/debug/model")
     def debug_model():
         # report whether trained model is loaded
         try:
             loaded = bool(getattr(hpm, "_model", None))
-            return jsonify({
+            return _json({
                 "loaded": loaded,
                 "model_path": getattr(hpm, "MODEL_PATH", None),
                 "img_size": getattr(hpm, "_img_size", None),
@@ -111,41 +264,27 @@ def create_app() -> Flask:
                 "last_error": getattr(hpm, "_last_model_error", None),
             })
         except Exception as e:
-            return jsonify({"loaded": False, "error": str(e)}), 500
+            return _json({"loaded": False, "error": str(e)}), 500
 
     @app.post("/api/detections/multi_person")
-    def multi_person_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
-
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+    async def multi_person_detection():
+        image, user_id, error = _read_frame()
+        if error:
+            return error
 
-        result = infer_multi_person(image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await asyncio.to_thread(infer_multi_person, image)
+        result["user_id"] = user_id
+        return _json(result)
 
     @app.post("/api/detections/body_visibility")
-    def body_visibility_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+    async def body_visibility_detection():
+        image, user_id, error = _read_frame()
+        if error:
+            return error
 
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
-
-        result = infer_body_visibility(image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await asyncio.to_thread(infer_body_visibility, image)
+        result["user_id"] = user_id
+        return _json(result)
 
     @app.post("/api/alert")
     def send_alert():
@@ -155,37 +294,35 @@ def create_app() -> Flask:
         timestamp = payload.get("timestamp")
 
         if not (student and violation):
-            return jsonify({"error": "student and violation are required"}), 400
+            return _json({"error": "student and violation are required"}), 400
 
         ok, info = send_whatsapp_alert(
-            to_phone=os.environ.get("TWILIO_WHATSAPP_TO", ""),
+            to_phone=_TWILIO_TO,
             body=f"[Exam Alert] {student}: {violation} @ {timestamp}",
         )
-        return (jsonify({"sent": True, "sid": info}) if ok else
-                (jsonify({"sent": False, "error": info}), 500))
+        return (_json({"sent": True, "sid": info}) if ok else
+                (_json({"sent": False, "error": info}), 500))
 
     @app.post("/api/detections/unified")
-    def unified_detection():
+    async def unified_detection():
         """Run all detection models on the image and return comprehensive results"""
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+        image, user_id, error = _read_frame()
+        if error:
+            return error
 
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+        result = await asyncio.to_thread(infer_unified, image, user_id=user_id)
+        result["user_id"] = user_id
+        return _json(result)
 
-        result = infer_unified(image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+    # Encoded status bytes and their build time
+    status_cache = {"t": 0.0, "body": None}
 
     @app.get("/api/system/status")
     def system_status():
         """Get comprehensive status of all detection models"""
+        now = time.monotonic()
+        if status_cache["body"] is not None and now - status_cache["t"] < _STATUS_TTL:
+            return Response(status_cache["body"], mimetype="application/json")
         try:
             # Get unified system status
             unified_status = get_system_status()
@@ -230,76 +367,67 @@ def create_app() -> Flask:
             
             complete_status["system"]["models_loaded"] = models_loaded
             
-            import datetime
-            complete_status["system"]["timestamp"] = datetime.datetime.now().isoformat()
+            complete_status["system"]["timestamp"] = _dt.datetime.now().isoformat()
             
-            return jsonify(complete_status)
+            body = orjson.dumps(complete_status, option=orjson.OPT_SERIALIZE_NUMPY)
+            status_cache["t"], status_cache["body"] = now, body
+            return Response(body, mimetype="application/json")
             
         except Exception as e:
-            return jsonify({
+            return _json({
                 "system": {"status": "error", "error": str(e)},
                 "models": {},
                 "capabilities": {}
             }), 500
 
     # Serve static frontend
+    from os import path as osp
+
+    project_root = osp.abspath(osp.join(osp.dirname(__file__), ".."))
+    # Candidate frontend directories in priority order (new frontend first);
+    # resolved once here instead of probing the filesystem on every request
+    candidate_dirs = [
+        osp.join(project_root, "backend", "static"),
+        osp.join(project_root, "static"),
+        osp.join(project_root, "backend", "Safe_Exam_Monitor", "my-app", "dist"),
+        osp.join(project_root, "Safe_Exam_Monitor", "my-app", "dist"),
+        osp.join(project_root, "frontend"),
+    ]
+    static_dir = next((d for d in candidate_dirs if osp.isdir(d)), None)
+
+    def try_serve_file(rel_path: str):
+        file_path = safe_join(static_dir, rel_path)
+        if file_path is None:
+            return None
+        cached = _load_static(file_path)
+        if cached is not None:
+            data, content_type, etag = cached
+            resp = Response(data, mimetype=content_type)
+            resp.set_etag(etag)
+            return resp.make_conditional(request)
+        # Large files go through send_from_directory, which uses sendfile
+        if osp.isfile(file_path):
+            return send_from_directory(static_dir, rel_path, conditional=True)
+        return None
+
     @app.route("/", defaults={"path": "index.html"})
     @app.route("/<path:path>")
     def serve_frontend(path):
-        from os import path as osp
-
-        project_root = osp.abspath(osp.join(osp.dirname(__file__), ".."))
-        # Candidate frontend directories in priority order (new frontend first)
-        candidate_dirs = [
-            osp.join(project_root, "backend", "static"),
-            osp.join(project_root, "static"),
-            osp.join(project_root, "backend", "Safe_Exam_Monitor", "my-app", "dist"),
-            osp.join(project_root, "Safe_Exam_Monitor", "my-app", "dist"),
-            osp.join(project_root, "frontend"),
-        ]
-
-        def try_serve_file(base_dir: str, rel_path: str):
-            file_path_local = osp.join(base_dir, rel_path)
-            if osp.exists(file_path_local) and not osp.isdir(file_path_local):
-                with open(file_path_local, "rb") as f:
-                    content_local = f.read()
-                mime_types_local = {
-                    ".html": "text/html",
-                    ".css": "text/css",
-                    ".js": "application/javascript",
-                    ".png": "image/png",
-                    ".jpg": "image/jpeg",
-                    ".jpeg": "image/jpeg",
-                    ".gif": "image/gif",
-                    ".ico": "image/x-icon",
-                    ".svg": "image/svg+xml",
-                    ".json": "application/json",
-                }
-                ext_local = osp.splitext(rel_path)[1].lower()
-                content_type_local = mime_types_local.get(ext_local, "application/octet-stream")
-                return content_local, 200, {"Content-Type": content_type_local}
-            return None
+        if static_dir is None:
+            return "Frontend not found", 404
 
         # Serve static assets (not API routes)
         if path != "index.html" and not path.startswith("api/"):
-            for base in candidate_dirs:
-                if osp.exists(base):
-                    # Try direct path
-                    served = try_serve_file(base, path)
-                    if served:
-                        return served
-                    # Try assets subfolder (for Vite builds)
-                    served = try_serve_file(base, osp.join("assets", path))
-                    if served:
-                        return served
+            # Try direct path, then assets subfolder (for Vite builds)
+            for rel_path in (path, "assets/" + path):
+                served = try_serve_file(rel_path)
+                if served is not None:
+                    return served
 
         # Default to index.html for SPA-like routing
-        for base in candidate_dirs:
-            index_path = osp.join(base, "index.html")
-            if osp.exists(index_path):
-                with open(index_path, "rb") as f:
-                    return f.read(), 200, {"Content-Type": "text/html"}
-
+        served = try_serve_file("index.html")
+        if served is not None:
+            return served
         return "Frontend not found", 404
 
     return app
@@ -308,6 +436,6 @@ def create_app() -> Flask:
 if __name__ == "__main__":
     application = create_app()
     port = int(os.environ.get("PORT", "5000"))
-    application.run(host="0.0.0.0", port=port, debug=True)
+    application.run(host="0.0.0.0", port=port, debug=False, threaded=True)
 
 
@@ -1,15 +1,184 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_cors import CORS
-import base64
+try:
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+import json
 import os
 import sys
+import queue
+import threading
+import time
+from typing import Any
 import cv2
 import numpy as np
-from PIL import Image
-import io
+import msgspec
+import orjson
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from detections._yunet import face_cascade, fit, njit, unscale_boxes
 
 print("🚀 Starting AI Exam Monitor - Fixed Version")
 
+# OpenCV releases the GIL inside Haar/HOG, so the three detectors can overlap
+_POOL = ThreadPoolExecutor(max_workers=3)
+
+# Detectors are built once; detectMultiScale is safe to call from several threads
+_FACE_CASCADE = face_cascade()
+# Default people-detector geometry (L2Hys norm) with the pyramid capped at 32 levels (default 64)
+_HOG = cv2.HOGDescriptor((64, 128), (16, 16), (8, 8), (8, 8), 9, 1, -1, 0, 0.2, True, 32)
+_HOG.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+# Let OpenCV's T-API dispatch detection to OpenCL (GPU/iGPU) when a device is present
+_USE_OPENCL = cv2.ocl.haveOpenCL()
+if _USE_OPENCL:
+    cv2.ocl.setUseOpenCL(True)
+
+
+def _json(obj):
+    """Serialize obj with orjson (numpy scalars and arrays included) into a JSON response"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
+
+# None of these bodies depend on request state, so they are encoded at import
+_INDEX_JSON = json.dumps({
+    "message": "AI Exam Monitor API - Fixed Version",
+    "status": "running",
+    "version": "3.0",
+    "health": "/api/health",
+    "endpoints": [
+        "/api/health",
+        "/api/detections/head_pose",
+        "/api/detections/multi_person",
+        "/api/detections/body_visibility",
+        "/api/detections/unified",
+        "/api/system/status",
+        "/api/alert",
+    ],
+}).encode()
+_HEALTH_JSON = json.dumps({"status": "ok", "message": "All systems operational"}).encode()
+_SYSTEM_STATUS_JSON = json.dumps({
+    "system": {
+        "status": "operational",
+        "version": "3.0-opencv",
+        "models_loaded": 3,
+        "timestamp": ""
+    },
+    "models": {
+        "head_pose": {"available": True, "method": "opencv_simple"},
+        "multi_person": {"available": True, "method": "opencv_hog"},
+        "body_visibility": {"available": True, "method": "opencv_simple"}
+    },
+    "capabilities": {
+        "multi_person_detection": True,
+        "head_pose_detection": True,
+        "body_visibility_detection": True,
+        "unified_inference": True
+    }
+}).encode()
+
+
+def _to_device(image):
+    """Wrap image in a cv2.UMat when OpenCL is available, otherwise return it unchanged"""
+    return cv2.UMat(image) if _USE_OPENCL else image
+
+
+# Pose codes returned by _classify_head_pose
+_POSE_NAMES = {0: "forward", 1: "left", 2: "right"}
+
+
+@njit(cache=True)
+def _classify_head_pose(faces, img_w):
+    """Pick the largest face in an (N, 4) int32 array and classify it by horizontal offset.
+
+    Returns (pose_code, violation, face_idx); pose_code is -1 when there are no faces.
+    """
+    if faces.shape[0] == 0:
+        return -1, False, -1
+    best = 0
+    best_area = faces[0, 2] * faces[0, 3]
+    for i in range(1, faces.shape[0]):
+        area = faces[i, 2] * faces[i, 3]
+        if area > best_area:
+            best = i
+            best_area = area
+    w = faces[best, 2]
+    img_center_x = img_w // 2
+    face_center_x = faces[best, 0] + w // 2
+    if face_center_x < img_center_x - w * 0.3:
+        return 2, True, best
+    if face_center_x > img_center_x + w * 0.3:
+        return 1, True, best
+    return 0, False, best
+
+
+# Compile once at import so the first request doesn't pay for it
+_classify_head_pose(np.zeros((1, 4), dtype=np.int32), 64)
+
+
+class Payload(msgspec.Struct):
+    """Body of the /api/detections/* requests"""
+    image_b64: str = ""
+    user_id: Any = None
+
+
+def _parse_payload() -> Payload:
+    """Decode the request body straight from bytes; malformed bodies yield an empty payload"""
+    try:
+        return msgspec.json.decode(request.get_data(cache=False), type=Payload)
+    except msgspec.DecodeError:
+        return Payload()
+
+
+def _strip_data_url(s: str) -> str:
+    """Drop a "data:image/...;base64," prefix; only the header region is searched"""
+    i = s.find(",", 0, 128)
+    return s[i + 1:] if i >= 0 else s
+
+
+class BatchQueue:
+    """Coalesce concurrently submitted frames into small batches for a worker pool"""
+
+    def __init__(self, fn, max_batch=8, max_wait=0.015):
+        self._fn = fn
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_batch)
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, image):
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def _run(self, image, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._fn(image))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _worker(self):
+        while True:
+            # Block for the first frame, then collect more until the batch fills or the window closes
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Frames differ in size so they can't be stacked for HOG; run them side by side instead
+            for image, future in batch:
+                self._executor.submit(self._run, image, future)
+
+
 def create_app():
     app = Flask(__name__)
     CORS(app)
@@ -18,58 +187,45 @@ def create_app():
 
     @app.get("/")
     def index():
-        return jsonify({
-            "message": "AI Exam Monitor API - Fixed Version",
-            "status": "running",
-            "version": "3.0",
-            "health": "/api/health",
-            "endpoints": [
-                "/api/health",
-                "/api/detections/head_pose",
-                "/api/detections/multi_person", 
-                "/api/detections/body_visibility",
-                "/api/detections/unified",
-                "/api/system/status",
-                "/api/alert",
-            ],
-        })
+        return app.response_class(_INDEX_JSON, mimetype="application/json")
 
     @app.get("/api/health")
     def health():
-        return {"status": "ok", "message": "All systems operational"}
+        return app.response_class(_HEALTH_JSON, mimetype="application/json")
 
     def process_image_bytes(image_b64):
         """Convert base64 to OpenCV image"""
         try:
             # Remove data:image/jpeg;base64, prefix if present
-            if "," in image_b64:
-                image_b64 = image_b64.split(",")[1]
+            image_b64 = _strip_data_url(image_b64)
             
-            # Decode base64
-            image_bytes = base64.b64decode(image_b64)
+            # Decode base64 straight into a uint8 buffer
+            raw = _b64.b64decode(image_b64, validate=False)
+            buf = np.frombuffer(raw, dtype=np.uint8)
             
-            # Convert to PIL image
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            
-            # Convert to OpenCV format
-            opencv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            # cv2.imdecode returns BGR directly, no PIL round-trip needed
+            opencv_image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+            if opencv_image is None:
+                return None, "could not decode image"
             
             return opencv_image, None
         except Exception as e:
             return None, str(e)
 
+    def _detect_faces(gray):
+        """Run the frontal face Haar cascade on a grayscale image"""
+        small, scale = fit(gray)
+        return unscale_boxes(_FACE_CASCADE.detectMultiScale(_to_device(small), 1.1, 4), scale)
+
     # Simple head pose detection using OpenCV
-    def detect_head_pose_simple(image):
+    def detect_head_pose_simple(image, gray=None, faces=None):
         """Simple head pose detection using face detection"""
         try:
-            # Load cascade classifier
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Detect faces
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Detect faces unless the caller already did
+            if faces is None:
+                if gray is None:
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                faces = _detect_faces(gray)
             
             if len(faces) == 0:
                 return {
@@ -79,30 +235,18 @@ def create_app():
                     "method": "opencv_simple"
                 }
             
-            # Use the largest face
-            x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
-            
-            # Simple heuristic for head pose based on face position
-            img_center_x = image.shape[1] // 2
-            face_center_x = x + w // 2
-            
-            # Determine head direction
-            if face_center_x < img_center_x - w * 0.3:
-                head_pose = "right"
-                violation = True
-            elif face_center_x > img_center_x + w * 0.3:
-                head_pose = "left"
-                violation = True
-            else:
-                head_pose = "forward"
-                violation = False
+            # Classify the largest face by its offset from the image center
+            faces = np.ascontiguousarray(faces, dtype=np.int32)
+            pose_code, violation, face_idx = _classify_head_pose(faces, image.shape[1])
+            head_pose = _POSE_NAMES[pose_code]
+            x, y, w, h = faces[face_idx]
             
             return {
                 "head_pose": head_pose,
                 "confidence": 0.8,
                 "violation": violation,
                 "method": "opencv_simple",
-                "face_location": {"x": int(x), "y": int(y), "width": int(w), "height": int(h)}
+                "face_location": {"x": x, "y": y, "width": w, "height": h}
             }
             
         except Exception as e:
@@ -118,12 +262,13 @@ def create_app():
     def detect_multi_person_simple(image):
         """Simple multi-person detection using HOG"""
         try:
-            # Initialize HOG descriptor
-            hog = cv2.HOGDescriptor()
-            hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-            
-            # Detect people
-            boxes, weights = hog.detectMultiScale(image, winStride=(8,8))
+            # Detect people on a downscaled frame
+            small, scale = fit(image)
+            boxes, weights = _HOG.detectMultiScale(
+                _to_device(small), winStride=(8,8), padding=(16,16), scale=1.2,
+                hitThreshold=0.0
+            )
+            boxes = unscale_boxes(boxes, scale)
             
             # Filter detections by weight
             filtered_boxes = []
@@ -139,7 +284,7 @@ def create_app():
                 "violation": num_people > 1,
                 "method": "opencv_hog",
                 "people_locations": [
-                    {"x": int(x), "y": int(y), "width": int(w), "height": int(h)} 
+                    {"x": x, "y": y, "width": w, "height": h} 
                     for x, y, w, h in filtered_boxes
                 ]
             }
@@ -154,17 +299,14 @@ def create_app():
             }
 
     # Simple body visibility detection
-    def detect_body_visibility_simple(image):
+    def detect_body_visibility_simple(image, gray=None, faces=None):
         """Simple body visibility detection using face detection"""
         try:
-            # Load cascade classifiers
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            
-            # Convert to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Detect faces
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Detect faces unless the caller already did
+            if faces is None:
+                if gray is None:
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                faces = _detect_faces(gray)
             
             if len(faces) == 0:
                 return {
@@ -196,8 +338,8 @@ def create_app():
                 "confidence": 0.8 if good_visibility else 0.4,
                 "violation": not good_visibility,
                 "method": "opencv_simple",
-                "face_location": {"x": int(x), "y": int(y), "width": int(w), "height": int(h)},
-                "face_ratio": float(face_ratio)
+                "face_location": {"x": x, "y": y, "width": w, "height": h},
+                "face_ratio": face_ratio
             }
             
         except Exception as e:
@@ -210,85 +352,98 @@ def create_app():
                 "method": "opencv_simple"
             }
 
+    def run_all_detections(image):
+        """Run all detections, sharing one grayscale conversion and one face detection"""
+        # HOG runs on the pool while this thread does the Haar pass
+        multi_person_future = _POOL.submit(detect_multi_person_simple, image)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = _detect_faces(gray)
+        head_pose_result = detect_head_pose_simple(image, gray, faces)
+        body_visibility_result = detect_body_visibility_simple(image, gray, faces)
+        return head_pose_result, multi_person_future.result(), body_visibility_result
+
+    unified_batcher = BatchQueue(run_all_detections)
+
     @app.post("/api/detections/head_pose")
     def head_pose_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
+        payload = _parse_payload()
+        image_b64 = payload.image_b64
+        user_id = payload.user_id
         
         if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+            return _json({"error": "image_b64 required"}), 400
         
         # Process image
         image, error = process_image_bytes(image_b64)
         if image is None:
-            return jsonify({"error": f"Image processing failed: {error}"}), 400
+            return _json({"error": f"Image processing failed: {error}"}), 400
         
         # Detect head pose
         result = detect_head_pose_simple(image)
         result["user_id"] = user_id
         
-        return jsonify(result)
+        return _json(result)
 
     @app.post("/api/detections/multi_person")
     def multi_person_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
+        payload = _parse_payload()
+        image_b64 = payload.image_b64
+        user_id = payload.user_id
         
         if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+            return _json({"error": "image_b64 required"}), 400
         
         # Process image
         image, error = process_image_bytes(image_b64)
         if image is None:
-            return jsonify({"error": f"Image processing failed: {error}"}), 400
+            return _json({"error": f"Image processing failed: {error}"}), 400
         
         # Detect multiple people
         result = detect_multi_person_simple(image)
         result["user_id"] = user_id
         
-        return jsonify(result)
+        return _json(result)
 
     @app.post("/api/detections/body_visibility")
     def body_visibility_detection():
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
+        payload = _parse_payload()
+        image_b64 = payload.image_b64
+        user_id = payload.user_id
         
         if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+            return _json({"error": "image_b64 required"}), 400
         
         # Process image
         image, error = process_image_bytes(image_b64)
         if image is None:
-            return jsonify({"error": f"Image processing failed: {error}"}), 400
+            return _json({"error": f"Image processing failed: {error}"}), 400
         
         # Detect body visibility
         result = detect_body_visibility_simple(image)
         result["user_id"] = user_id
         
-        return jsonify(result)
+        return _json(result)
 
     @app.post("/api/detections/unified")
     def unified_detection():
         """Run all detection models on the image and return comprehensive results"""
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
+        payload = _parse_payload()
+        image_b64 = payload.image_b64
+        user_id = payload.user_id
         
         if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+            return _json({"error": "image_b64 required"}), 400
         
         # Process image
         image, error = process_image_bytes(image_b64)
         if image is None:
-            return jsonify({"error": f"Image processing failed: {error}"}), 400
+            return _json({"error": f"Image processing failed: {error}"}), 400
         
-        # Run all detections
-        head_pose_result = detect_head_pose_simple(image)
-        multi_person_result = detect_multi_person_simple(image)
-        body_visibility_result = detect_body_visibility_simple(image)
+        # Run all detections through the micro-batcher
+        try:
+            head_pose_result, multi_person_result, body_visibility_result = unified_batcher.submit(image).result(timeout=2.0)
+        except FuturesTimeoutError:
+            return _json({"error": "Detection timed out"}), 503
         
         # Combine results
         unified_result = {
@@ -307,30 +462,12 @@ def create_app():
         import datetime
         unified_result["timestamp"] = datetime.datetime.now().isoformat()
         
-        return jsonify(unified_result)
+        return _json(unified_result)
 
     @app.get("/api/system/status")
     def system_status():
         """Get system status"""
-        return jsonify({
-            "system": {
-                "status": "operational",
-                "version": "3.0-opencv",
-                "models_loaded": 3,
-                "timestamp": ""
-            },
-            "models": {
-                "head_pose": {"available": True, "method": "opencv_simple"},
-                "multi_person": {"available": True, "method": "opencv_hog"},
-                "body_visibility": {"available": True, "method": "opencv_simple"}
-            },
-            "capabilities": {
-                "multi_person_detection": True,
-                "head_pose_detection": True,
-                "body_visibility_detection": True,
-                "unified_inference": True
-            }
-        })
+        return app.response_class(_SYSTEM_STATUS_JSON, mimetype="application/json")
 
     @app.post("/api/alert")
     def send_alert():
@@ -340,13 +477,13 @@ def create_app():
         timestamp = payload.get("timestamp")
 
         if not (student and violation):
-            return jsonify({"error": "student and violation are required"}), 400
+            return _json({"error": "student and violation are required"}), 400
 
         # Simple console alert (Twilio can be added later)
         alert_message = f"[Exam Alert] {student}: {violation} @ {timestamp}"
         print(f"🚨 ALERT: {alert_message}")
         
-        return jsonify({"sent": True, "message": alert_message, "method": "console"})
+        return _json({"sent": True, "message": alert_message, "method": "console"})
 
     return app
 
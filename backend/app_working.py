@@ -1,49 +1,184 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import base64
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+import orjson
+try:
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+import asyncio
+import datetime as _dt
+import json
 import os
 import logging
 import threading
 import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Callable, Optional
+
+from batcher import MicroBatcher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Seconds a cached status response stays valid between polls
+_STATUS_TTL = 0.5
+
+# WhatsApp recipient for send_whatsapp_alert, taken from the environment at startup
+_TWILIO_TO = os.environ.get("TWILIO_WHATSAPP_TO", "")
+
+# Static responses are serialized once per model-loaded state
+_INDEX_JSON = {
+    loaded: json.dumps({
+        "message": "AI Exam Monitor API",
+        "status": "running",
+        "models_loaded": loaded,
+        "health": "/api/health",
+        "endpoints": [
+            "/api/health",
+            "/api/detections/head_pose",
+            "/api/detections/multi_person",
+            "/api/detections/body_visibility",
+            "/api/detections/unified",
+            "/api/system/status",
+            "/api/alert",
+        ],
+    }).encode()
+    for loaded in (False, True)
+}
+_HEALTH_JSON = {
+    loaded: json.dumps({"status": "ok", "models_loaded": loaded}).encode()
+    for loaded in (False, True)
+}
+
+# Cap concurrent heavy inference per model so OpenCV/MediaPipe thread pools don't oversubscribe the CPU;
+# decoding and JSON serialization stay unbounded
+_HEADPOSE_SEM = asyncio.Semaphore(4)
+_BODY_SEM = asyncio.Semaphore(4)
+_MULTI_SEM = asyncio.Semaphore(2)
+_UNIFIED_SEM = asyncio.Semaphore(2)
+
+
+def _per_item(name: str):
+    """Batch function that applies the named single-frame inference function to each frame"""
+    return lambda images: list(map(getattr(_REG, name), images))
+
+
+# Frames arriving within 15 ms of each other are run as one batch per model
+# Head-pose items are (image, user_id) so the MediaPipe fallback can track each user's face
+_HEAD_POSE_BATCHER = MicroBatcher(
+    lambda items: _REG.infer_head_pose_batch([image for image, _ in items], [user_id for _, user_id in items]),
+    semaphore=_HEADPOSE_SEM,
+)
+_BODY_BATCHER = MicroBatcher(_per_item('infer_body_visibility'), semaphore=_BODY_SEM)
+_MULTI_BATCHER = MicroBatcher(lambda images: _REG.infer_multi_person_batch(images), semaphore=_MULTI_SEM)
+# Unified items are (image, user_id); the person model runs the whole batch in one predict call
+_UNIFIED_BATCHER = MicroBatcher(
+    lambda items: _REG.infer_unified_batch([image for image, _ in items], [user_id for _, user_id in items]),
+    semaphore=_UNIFIED_SEM,
+)
+
+
+@dataclass(frozen=True)
+class _Registry:
+    """Model entry points, bound once by load_models_async"""
+    load_config: Callable
+    infer_head_pose: Callable
+    infer_head_pose_batch: Callable
+    infer_multi_person: Callable
+    infer_multi_person_batch: Callable
+    infer_body_visibility: Callable
+    infer_unified_batch: Callable
+    get_system_status: Callable
+    send_whatsapp_alert: Callable
+    hpm: ModuleType
+
+
 # Lazy imports for models
-_models_loaded = False
+_REG: Optional[_Registry] = None
 _model_loading_lock = threading.Lock()
+# Set on the event loop once load_models_async has succeeded; requests await it instead of polling
+_models_ready = asyncio.Event()
+_MODELS_READY_TIMEOUT = 30.0
+
+
+def _strip_data_url(s: str) -> str:
+    """Drop a "data:image/...;base64," prefix; only the header region is searched"""
+    i = s.find(",", 0, 128)
+    return s[i + 1:] if i >= 0 else s
+
+
+def _decode_image_b64(s: str) -> bytes:
+    """Decode a base64 (optionally data-URL) image payload to raw bytes"""
+    return _b64.b64decode(_strip_data_url(s), validate=False)
+
+
+async def _read_json(request: Request) -> dict:
+    """Parse the JSON body, treating malformed or non-object bodies as empty"""
+    try:
+        payload = await request.json()
+    except Exception:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+async def _read_image(request: Request):
+    """(image_bytes, user_id, error_response) for a detection request.
+
+    JSON bodies carry a base64 image_b64; with ?raw=1 or an application/octet-stream body the
+    request body is the encoded image itself and user_id comes from the query string.
+    """
+    if (request.query_params.get("raw") == "1"
+            or request.headers.get("content-type", "").startswith("application/octet-stream")):
+        user_id = request.query_params.get("user_id")
+        image_bytes = await request.body()
+        if not image_bytes:
+            return None, user_id, ORJSONResponse({"error": "image body required"}, status_code=400)
+        return image_bytes, user_id, None
+
+    payload = await _read_json(request)
+    image_b64 = payload.get("image_b64")
+    user_id = payload.get("user_id")
+    if not image_b64:
+        return None, user_id, ORJSONResponse({"error": "image_b64 required"}, status_code=400)
+    try:
+        return _decode_image_b64(image_b64), user_id, None
+    except Exception:
+        return None, user_id, ORJSONResponse({"error": "invalid base64 image"}, status_code=400)
+
 
 def load_models_async():
     """Load models in background"""
-    global _models_loaded
+    global _REG
     with _model_loading_lock:
-        if _models_loaded:
+        if _REG is not None:
             return
         
         logger.info("Loading AI models in background...")
         try:
             from config import load_config
-            from detections.head_pose import infer_head_pose
-            from detections.multi_person import infer_multi_person
+            from detections.head_pose import infer_head_pose, infer_head_pose_batch
+            from detections.multi_person import infer_multi_person, infer_multi_person_batch
             from detections.body_visibility import infer_body_visibility
-            from detections.unified_detection import infer_unified, get_system_status
+            from detections.unified_detection import infer_unified_batch, get_system_status
             from alerts.twilio_client import send_whatsapp_alert
             from detections import head_pose_model as hpm
             
-            # Store in globals for later use
-            globals().update({
-                'load_config': load_config,
-                'infer_head_pose': infer_head_pose,
-                'infer_multi_person': infer_multi_person,
-                'infer_body_visibility': infer_body_visibility,
-                'infer_unified': infer_unified,
-                'get_system_status': get_system_status,
-                'send_whatsapp_alert': send_whatsapp_alert,
-                'hpm': hpm
-            })
-            
-            _models_loaded = True
+            _REG = _Registry(
+                load_config=load_config,
+                infer_head_pose=infer_head_pose,
+                infer_head_pose_batch=infer_head_pose_batch,
+                infer_multi_person=infer_multi_person,
+                infer_multi_person_batch=infer_multi_person_batch,
+                infer_body_visibility=infer_body_visibility,
+                infer_unified_batch=infer_unified_batch,
+                get_system_status=get_system_status,
+                send_whatsapp_alert=send_whatsapp_alert,
+                hpm=hpm,
+            )
             logger.info("✓ All models loaded successfully!")
             
         except Exception as e:
@@ -51,156 +186,133 @@ def load_models_async():
             import traceback
             traceback.print_exc()
 
-def create_app() -> Flask:
-    app = Flask(__name__)
-    CORS(app)
+
+async def _load_models_and_signal():
+    await asyncio.to_thread(load_models_async)
+    if _REG is not None:
+        _models_ready.set()
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Start loading models in background; the server accepts traffic meanwhile
+    app.state.model_loader = asyncio.create_task(_load_models_and_signal())
+    yield
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=_lifespan, default_response_class=ORJSONResponse)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
     # Load config immediately
     try:
         from config import load_config
         cfg = load_config()
-        app.config.update(cfg)
+        app.state.config = cfg
         logger.info("✓ Configuration loaded")
     except Exception as e:
         logger.error(f"Config loading failed: {e}")
 
-    # Start loading models in background
-    threading.Thread(target=load_models_async, daemon=True).start()
+    # Keep each OpenCV call single-threaded so the semaphores above control parallelism
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
 
     @app.get("/")
-    def index():
-        return jsonify({
-            "message": "AI Exam Monitor API",
-            "status": "running",
-            "models_loaded": _models_loaded,
-            "health": "/api/health",
-            "endpoints": [
-                "/api/health",
-                "/api/detections/head_pose",
-                "/api/detections/multi_person", 
-                "/api/detections/body_visibility",
-                "/api/detections/unified",
-                "/api/system/status",
-                "/api/alert",
-            ],
-        })
+    async def index():
+        return Response(_INDEX_JSON[_models_ready.is_set()], media_type="application/json")
 
     @app.get("/api/health")
-    def health():
-        return {"status": "ok", "models_loaded": _models_loaded}
+    async def health():
+        return Response(_HEALTH_JSON[_models_ready.is_set()], media_type="application/json")
 
-    def ensure_models_loaded():
+    async def ensure_models_loaded():
         """Ensure models are loaded before processing"""
-        if not _models_loaded:
-            # Wait up to 30 seconds for models to load
-            for i in range(30):
-                if _models_loaded:
-                    break
-                time.sleep(1)
-            
-            if not _models_loaded:
-                return jsonify({"error": "Models still loading, please try again in a moment"}), 503
+        if not _models_ready.is_set():
+            try:
+                await asyncio.wait_for(_models_ready.wait(), timeout=_MODELS_READY_TIMEOUT)
+            except asyncio.TimeoutError:
+                return ORJSONResponse({"error": "Models still loading, please try again in a moment"}, status_code=503)
         return None
 
     @app.post("/api/detections/head_pose")
-    def head_pose_detection():
-        error = ensure_models_loaded()
+    async def head_pose_detection(request: Request):
+        error = await ensure_models_loaded()
         if error:
             return error
             
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
-
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+        image_bytes, user_id, error = await _read_image(request)
+        if error:
+            return error
 
-        result = globals()['infer_head_pose'](image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await _HEAD_POSE_BATCHER.submit((image_bytes, user_id))
+        result["user_id"] = user_id
+        return ORJSONResponse(result)
 
     @app.post("/api/detections/multi_person")
-    def multi_person_detection():
-        error = ensure_models_loaded()
+    async def multi_person_detection(request: Request):
+        error = await ensure_models_loaded()
         if error:
             return error
             
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
-
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+        image_bytes, user_id, error = await _read_image(request)
+        if error:
+            return error
 
-        result = globals()['infer_multi_person'](image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await _MULTI_BATCHER.submit(image_bytes)
+        result["user_id"] = user_id
+        return ORJSONResponse(result)
 
     @app.post("/api/detections/body_visibility")
-    def body_visibility_detection():
-        error = ensure_models_loaded()
+    async def body_visibility_detection(request: Request):
+        error = await ensure_models_loaded()
         if error:
             return error
             
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
-
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+        image_bytes, user_id, error = await _read_image(request)
+        if error:
+            return error
 
-        result = globals()['infer_body_visibility'](image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+        result = await _BODY_BATCHER.submit(image_bytes)
+        result["user_id"] = user_id
+        return ORJSONResponse(result)
 
     @app.post("/api/detections/unified")
-    def unified_detection():
+    async def unified_detection(request: Request):
         """Run all detection models on the image and return comprehensive results"""
-        error = ensure_models_loaded()
+        error = await ensure_models_loaded()
         if error:
             return error
             
-        payload = request.get_json(silent=True) or {}
-        image_b64 = payload.get("image_b64")
-        user_id = payload.get("user_id")
-        
-        if not image_b64:
-            return jsonify({"error": "image_b64 required"}), 400
+        image_bytes, user_id, error = await _read_image(request)
+        if error:
+            return error
 
-        try:
-            image_bytes = base64.b64decode(image_b64.split(",")[-1])
-        except Exception:
-            return jsonify({"error": "invalid base64 image"}), 400
+        result = await _UNIFIED_BATCHER.submit((image_bytes, user_id))
+        result["user_id"] = user_id
+        return ORJSONResponse(result)
 
-        result = globals()['infer_unified'](image_bytes)
-        result.update({"user_id": user_id})
-        return jsonify(result)
+    # Status body cached across requests, rebuilt once _STATUS_TTL has elapsed
+    status_cache = {"t": 0.0, "body": None}
 
     @app.get("/api/system/status")
-    def system_status():
+    async def system_status():
         """Get comprehensive status of all detection models"""
-        if not _models_loaded:
-            return jsonify({
+        now = time.monotonic()
+        if status_cache["body"] is not None and now - status_cache["t"] < _STATUS_TTL:
+            return Response(status_cache["body"], media_type="application/json")
+        if not _models_ready.is_set():
+            return ORJSONResponse({
                 "system": {"status": "loading", "models_loaded": False},
                 "message": "Models are still loading..."
             })
             
         try:
             # Get unified system status
-            unified_status = globals()['get_system_status']()
-            hpm = globals()['hpm']
+            unified_status = _REG.get_system_status()
+            hpm = _REG.hpm
             
             # Add head pose model status
             head_pose_status = {
@@ -242,29 +354,30 @@ def create_app() -> Flask:
             
             complete_status["system"]["models_loaded"] = models_loaded
             
-            import datetime
-            complete_status["system"]["timestamp"] = datetime.datetime.now().isoformat()
+            complete_status["system"]["timestamp"] = _dt.datetime.now().isoformat()
             
-            return jsonify(complete_status)
+            body = orjson.dumps(complete_status, option=orjson.OPT_SERIALIZE_NUMPY)
+            status_cache["t"], status_cache["body"] = now, body
+            return Response(body, media_type="application/json")
             
         except Exception as e:
             logger.error(f"Error getting system status: {e}")
-            return jsonify({
+            return ORJSONResponse({
                 "system": {"status": "error", "error": str(e)},
                 "models": {},
                 "capabilities": {}
-            }), 500
+            }, status_code=500)
 
     @app.get("/api/debug/model")
-    def debug_model():
-        if not _models_loaded:
-            return jsonify({"loaded": False, "status": "loading"})
+    async def debug_model():
+        if not _models_ready.is_set():
+            return ORJSONResponse({"loaded": False, "status": "loading"})
             
         # report whether trained model is loaded
         try:
-            hpm = globals()['hpm']
+            hpm = _REG.hpm
             loaded = bool(getattr(hpm, "_model", None))
-            return jsonify({
+            return ORJSONResponse({
                 "loaded": loaded,
                 "model_path": getattr(hpm, "MODEL_PATH", None),
                 "img_size": getattr(hpm, "_img_size", None),
@@ -272,32 +385,31 @@ def create_app() -> Flask:
                 "last_error": getattr(hpm, "_last_model_error", None),
             })
         except Exception as e:
-            return jsonify({"loaded": False, "error": str(e)}), 500
+            return ORJSONResponse({"loaded": False, "error": str(e)}, status_code=500)
 
     @app.post("/api/alert")
-    def send_alert():
-        error = ensure_models_loaded()
+    async def send_alert(request: Request):
+        error = await ensure_models_loaded()
         if error:
             return error
             
-        payload = request.get_json(silent=True) or {}
+        payload = await _read_json(request)
         student = payload.get("student")
         violation = payload.get("violation")
         timestamp = payload.get("timestamp")
 
         if not (student and violation):
-            return jsonify({"error": "student and violation are required"}), 400
+            return ORJSONResponse({"error": "student and violation are required"}, status_code=400)
 
         try:
-            send_whatsapp_alert = globals()['send_whatsapp_alert']
-            ok, info = send_whatsapp_alert(
-                to_phone=os.environ.get("TWILIO_WHATSAPP_TO", ""),
+            ok, info = _REG.send_whatsapp_alert(
+                to_phone=_TWILIO_TO,
                 body=f"[Exam Alert] {student}: {violation} @ {timestamp}",
             )
-            return (jsonify({"sent": True, "sid": info}) if ok else
-                    (jsonify({"sent": False, "error": info}), 500))
+            return (ORJSONResponse({"sent": True, "sid": info}) if ok else
+                    ORJSONResponse({"sent": False, "error": info}, status_code=500))
         except Exception as e:
-            return jsonify({"sent": False, "error": f"Alert system not loaded: {e}"}), 500
+            return ORJSONResponse({"sent": False, "error": f"Alert system not loaded: {e}"}, status_code=500)
 
     return app
 
@@ -306,6 +418,8 @@ if __name__ == "__main__":
     os.environ['HEAD_POSE_MODEL_PATH'] = r"C:\Users\sanke\OneDrive\Documents\EDI\Project\Project\ml\models\head_pose_mobilenet_final.h5"
     os.environ['HEAD_POSE_MODEL_INFO_PATH'] = r"C:\Users\sanke\OneDrive\Documents\EDI\Project\Project\ml\models\head_pose_mobilenet_info.json"
     
+    import uvicorn
+
     application = create_app()
     port = int(os.environ.get("PORT", "5000"))
     
@@ -313,4 +427,5 @@ if __name__ == "__main__":
     logger.info("📍 Models will load in background - API available immediately")
     logger.info("🔗 Frontend: Open C:\\Users\\sanke\\OneDrive\\Documents\\EDI\\Project\\Project\\frontend\\index.html")
     
-    application.run(host="0.0.0.0", port=port, debug=False, threaded=True)
+    # Equivalent CLI: uvicorn app_working:create_app --factory --loop uvloop --port 5000
+    uvicorn.run(application, host="0.0.0.0", port=port)
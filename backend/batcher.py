@@ -0,0 +1,88 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Set
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent async requests into small batches for a blocking batch function.
+
+    The first queued item opens a window of ``max_wait_ms``; everything that arrives before
+    the window closes (up to ``max_batch`` items) is handed to ``batch_fn`` in one call on a
+    worker thread. The window is measured from the first item's arrival so no request waits
+    longer than ``max_wait_ms`` for its batch to start.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch: int = 16,
+                 max_wait_ms: float = 15.0, semaphore: Optional[asyncio.Semaphore] = None):
+        self._batch_fn = batch_fn
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000.0
+        self._semaphore = semaphore
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Strong references to in-flight dispatches; the loop only keeps weak ones
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Created lazily, and again if the app is served from a new loop, so the queue and
+            # collector always belong to the loop that is running
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._dispatches = set()
+            self._task = loop.create_task(self._collect(self._queue))
+        future = loop.create_future()
+        await self._queue.put((item, future, loop.time()))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item, future, arrived = await queue.get()
+            batch = [(item, future)]
+            deadline = arrived + self._max_wait
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item, future, _ = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append((item, future))
+            # Dispatch without waiting so the next window can open while this batch runs
+            task = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    def _run(self, items):
+        """(ok, value) per item; if the batch call raises, items are retried one by one so a bad input only fails its own request"""
+        try:
+            return [(True, result) for result in self._batch_fn(items)]
+        except Exception as e:
+            if len(items) == 1:
+                return [(False, e)]
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((True, self._batch_fn([item])[0]))
+            except Exception as e:
+                outcomes.append((False, e))
+        return outcomes
+
+    async def _dispatch(self, batch):
+        items = [item for item, _ in batch]
+        if self._semaphore is not None:
+            async with self._semaphore:
+                outcomes = await asyncio.to_thread(self._run, items)
+        else:
+            outcomes = await asyncio.to_thread(self._run, items)
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
@@ -1,7 +1,10 @@
 import os
+from functools import lru_cache
 from typing import Dict, Any
 
 
+# Environment is read once per process; callers share the returned dict
+@lru_cache(maxsize=1)
 def load_config() -> Dict[str, Any]:
     return {
         "ENV": os.environ.get("FLASK_ENV", "development"),
@@ -0,0 +1,63 @@
+from typing import Optional, Tuple
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import turbojpeg
+    _tj = turbojpeg.TurboJPEG()
+except Exception:
+    # Module missing, or the libjpeg-turbo shared library could not be found
+    turbojpeg = None
+    _tj = None
+
+
+def decode_image(data: bytes, rgb: bool = False) -> Optional["np.ndarray"]:
+    """Decode an encoded frame to a BGR (or RGB) uint8 array; None if it can't be decoded.
+
+    JPEG goes through libjpeg-turbo when PyTurboJPEG is installed, anything else through cv2.imdecode.
+    """
+    if not data:
+        return None
+    if _tj is not None and data[:2] == b'\xff\xd8':
+        try:
+            return _tj.decode(data, pixel_format=turbojpeg.TJPF_RGB if rgb else turbojpeg.TJPF_BGR)
+        except Exception:
+            pass
+    if cv2 is None or np is None:
+        return None
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        return None
+    if frame is not None and rgb:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return frame
+
+
+def decode_jpeg_scaled(data: bytes, max_side: int, rgb: bool = False) -> Optional[Tuple["np.ndarray", float]]:
+    """Decode a JPEG with libjpeg-turbo, letting the IDCT shrink it towards max_side on its longer side.
+
+    Returns the array and the factor mapping its coordinates back to the full image, or None when
+    PyTurboJPEG is unavailable or data is not a decodable JPEG.
+    """
+    if _tj is None or data[:2] != b'\xff\xd8':
+        return None
+    try:
+        width, height, _, _ = _tj.decode_header(data)
+        ratio = max_side / max(width, height)
+        factor = None
+        if ratio < 1.0:
+            # Strongest supported reduction that still leaves at least max_side pixels
+            candidates = [f for f in _tj.scaling_factors if ratio <= f[0] / f[1] < 1.0]
+            if candidates:
+                factor = min(candidates, key=lambda f: f[0] / f[1])
+        frame = _tj.decode(data, pixel_format=turbojpeg.TJPF_RGB if rgb else turbojpeg.TJPF_BGR, scaling_factor=factor)
+    except Exception:
+        return None
+    return frame, width / frame.shape[1]
@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+try:
+    from ultralytics import YOLO
+except ImportError:
+    YOLO = None
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+# MULTI_PERSON_QUANTIZED=1 serves an INT8 (dynamic-range quantized) ONNX export of each .pt, built on
+# first use and reused from <weights>_int8.onnx, through Ultralytics' ONNX Runtime backend
+QUANTIZED = os.environ.get('MULTI_PERSON_QUANTIZED') == '1'
+# USE_OPENVINO=1 serves an INT8 OpenVINO IR export (<weights>_openvino_model/, exported and calibrated on
+# OPENVINO_CALIB_DATA the first time) for Intel CPUs; takes precedence over MULTI_PERSON_QUANTIZED
+USE_OPENVINO = os.environ.get('USE_OPENVINO') == '1'
+OPENVINO_CALIB_DATA = os.environ.get('OPENVINO_CALIB_DATA', 'coco128.yaml')
+# Inference resolution for person detection; 320 is a quarter of the conv work of Ultralytics' 640 default
+IMGSZ = int(os.environ.get('MULTI_PERSON_IMGSZ', 320))
+
+
+def _load_openvino(weights: str):
+    """YOLO model backed by the OpenVINO IR export of weights, exporting it first if needed"""
+    ov_dir = os.path.splitext(weights)[0] + '_openvino_model'
+    if not os.path.isdir(ov_dir):
+        ov_dir = YOLO(weights).export(format='openvino', int8=True, data=OPENVINO_CALIB_DATA, imgsz=IMGSZ)
+    return YOLO(ov_dir, task='detect')
+
+
+def _load_int8_onnx(weights: str):
+    """YOLO model backed by an INT8 ONNX export of weights, exporting and quantizing it first if needed"""
+    int8_path = os.path.splitext(weights)[0] + '_int8.onnx'
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        # FP32 export first; Ultralytics' half=True only applies on CUDA and is ignored on CPU
+        onnx_path = YOLO(weights).export(format='onnx', imgsz=IMGSZ)
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return YOLO(int8_path, task='detect')
+
+
+def _load_yolo(weights: str):
+    """YOLO model for weights, swapped for its OpenVINO or INT8 ONNX export when enabled"""
+    model = None
+    if USE_OPENVINO:
+        try:
+            model = _load_openvino(weights)
+        except Exception as e:
+            # Keep serving from the .pt when OpenVINO is missing or the export fails
+            logger.warning("OpenVINO unavailable for %s, using PyTorch: %s", weights, e)
+    if model is None and QUANTIZED:
+        try:
+            model = _load_int8_onnx(weights)
+        except Exception as e:
+            logger.warning("INT8 ONNX export unavailable for %s, using PyTorch: %s", weights, e)
+    if model is None:
+        model = YOLO(weights)
+        # Fold BatchNorm into the preceding convolutions once instead of on every predict
+        model.fuse()
+    # Warm-up pass so backend setup and kernel selection don't land on the first request
+    model.predict(np.zeros((480, 640, 3), dtype=np.uint8), imgsz=IMGSZ, verbose=False)
+    return model
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models, so every detector shares one copy of each"""
+
+    def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+        self._loaders = loaders
+        self._models: Dict[str, Any] = {}
+        self._errors: Dict[str, Exception] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        """Loaded model for name; re-raises the original error if loading failed"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            # Another thread may have finished loading while we waited
+            if name in self._models:
+                return self._models[name]
+            if name in self._errors:
+                raise self._errors[name]
+            if YOLO is None:
+                raise RuntimeError("ultralytics is not installed")
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                self._errors[name] = e
+                raise
+            self._models[name] = model
+            return model
+
+
+registry = ModelRegistry({
+    'yolov8n': lambda: _load_yolo('yolov8n.pt'),
+    'crowdhuman_custom': lambda: _load_yolo(os.path.join(MODELS_DIR, 'crowdhuman_custom.pt')),
+})
@@ -0,0 +1,44 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+except Exception:
+    njit = None
+    prange = range
+
+
+def _nms_kernel(boxes, scores, iou_threshold):
+    """Greedy NMS over (N, 4) xyxy boxes; indices in descending score, ties in detection order"""
+    n = boxes.shape[0]
+    order = np.argsort(-scores, kind='mergesort')
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    # Pairwise IoU in score order; rows are independent, so they are spread across cores
+    iou = np.zeros((n, n), dtype=np.float32)
+    for a in prange(n):
+        i = order[a]
+        for b in range(a + 1, n):
+            j = order[b]
+            w = min(boxes[i, 2], boxes[j, 2]) - max(boxes[i, 0], boxes[j, 0])
+            h = min(boxes[i, 3], boxes[j, 3]) - max(boxes[i, 1], boxes[j, 1])
+            if w > 0 and h > 0:
+                inter = w * h
+                union = areas[i] + areas[j] - inter
+                if union > 0:
+                    iou[a, b] = inter / union
+    # The greedy pass itself is sequential but only reads the precomputed matrix
+    suppressed = np.zeros(n, dtype=np.bool_)
+    keep = np.empty(n, dtype=np.int64)
+    k = 0
+    for a in range(n):
+        if suppressed[a]:
+            continue
+        keep[k] = order[a]
+        k += 1
+        for b in range(a + 1, n):
+            if iou[a, b] >= iou_threshold:
+                suppressed[b] = True
+    return keep[:k]
+
+
+# Compiled on first call; None when numba is not installed
+nms_kernel = njit(parallel=True, fastmath=True, cache=True)(_nms_kernel) if njit is not None else None
@@ -0,0 +1,69 @@
+import copy
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+# Entries per cache; 0 disables caching
+CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+
+
+def _key(image) -> Optional[bytes]:
+    # Only encoded frames are hashed; decoded arrays come from callers that already share work
+    if not isinstance(image, (bytes, bytearray)):
+        return None
+    return hashlib.blake2b(image, digest_size=16).digest()
+
+
+class ResultCache:
+    """LRU of inference results keyed by a hash of the encoded frame, for re-submitted identical frames"""
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[bytes, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, image) -> Optional[bytes]:
+        return _key(image) if self._maxsize > 0 else None
+
+    def get(self, key: Optional[bytes]) -> Optional[Dict]:
+        if key is None:
+            return None
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                return None
+            self._entries.move_to_end(key)
+        # Callers may mutate the dict they get back
+        return copy.deepcopy(result)
+
+    def put(self, key: Optional[bytes], result: Dict) -> None:
+        # Failures are not cached so a retry gets a fresh attempt
+        if key is None or "error" in result or result.get("model_error"):
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+def cached_by_content(fn):
+    """Memoize fn(image, ...) on the image bytes; calls with extra arguments bypass the cache"""
+    cache = ResultCache()
+
+    @functools.wraps(fn)
+    def wrapper(image, *args, **kwargs):
+        key = None if args or kwargs else cache.key(image)
+        result = cache.get(key)
+        if result is None:
+            result = fn(image, *args, **kwargs)
+            cache.put(key, result)
+        return result
+
+    wrapper.cache = cache
+    return wrapper
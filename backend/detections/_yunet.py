@@ -0,0 +1,95 @@
+import os
+import threading
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from numba import njit
+except Exception:
+    def njit(*args, **kwargs):
+        """Stand-in decorator so the helpers still run as plain Python without numba"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+
+YUNET_MODEL_PATH = os.environ.get(
+    'YUNET_MODEL_PATH',
+    os.path.join(os.path.dirname(__file__), '..', 'models', 'face_detection_yunet_2023mar_int8.onnx')
+)
+YUNET_SCORE_THRESHOLD = float(os.environ.get('YUNET_SCORE_THRESHOLD', '0.7'))
+
+# Callers keep their Haar cascades as the fallback when this is False
+YUNET_AVAILABLE = (
+    cv2 is not None and np is not None
+    and hasattr(cv2, 'FaceDetectorYN')
+    and os.path.exists(YUNET_MODEL_PATH)
+)
+
+# setInputSize mutates the detector, so each worker thread gets its own instance
+_tls = threading.local()
+
+
+def _detector():
+    det = getattr(_tls, 'det', None)
+    if det is None:
+        det = cv2.FaceDetectorYN.create(YUNET_MODEL_PATH, '', (320, 320), YUNET_SCORE_THRESHOLD)
+        _tls.det = det
+    return det
+
+
+def detect_faces(bgr: "np.ndarray") -> "np.ndarray":
+    """Detect faces in a BGR frame; returns an (N, 4) int32 array of x, y, w, h boxes"""
+    h, w = bgr.shape[:2]
+    det = _detector()
+    det.setInputSize((w, h))
+    _, faces = det.detect(bgr)
+    if faces is None:
+        return np.empty((0, 4), dtype=np.int32)
+    return faces[:, :4].astype(np.int32)
+
+
+_cascade = None
+_cascade_loaded = False
+_cascade_lock = threading.Lock()
+
+
+def face_cascade():
+    """OpenCV's frontal-face Haar cascade, the fallback when YuNet is unavailable; parsed on first use and
+    shared (detectMultiScale is safe to call concurrently). None without OpenCV or the XML file"""
+    global _cascade, _cascade_loaded
+    if not _cascade_loaded:
+        with _cascade_lock:
+            if not _cascade_loaded:
+                if cv2 is not None:
+                    try:
+                        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+                        _cascade = None if cascade.empty() else cascade
+                    except Exception:
+                        _cascade = None
+                _cascade_loaded = True
+    return _cascade
+
+
+def fit(image: "np.ndarray", max_side: int = 480, buffer=None):
+    """Downscale image so its longest side is at most max_side; returns (image, scale).
+    buffer, if given, is called with the output shape and returns the array to resize into"""
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image, 1.0
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    out = buffer((size[1], size[0]) + image.shape[2:]) if buffer is not None else None
+    return cv2.resize(image, size, dst=out, interpolation=cv2.INTER_AREA), scale
+
+
+def unscale_boxes(boxes, scale: float):
+    """Map (x, y, w, h) boxes found on a downscaled image back to original coordinates"""
+    if scale == 1.0 or len(boxes) == 0:
+        return boxes
+    return (np.asarray(boxes) / scale).astype(np.int32)
@@ -1,5 +1,6 @@
-from typing import Dict
-import io
+import logging
+import threading
+from typing import Dict, Tuple, Union
 try:
     import cv2
 except ImportError:
@@ -8,44 +9,121 @@ try:
     import numpy as np
 except ImportError:
     np = None
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
 
+from ._yunet import YUNET_AVAILABLE, detect_faces as _yunet_faces, face_cascade, fit, unscale_boxes
+
+logger = logging.getLogger(__name__)
+
+
+def _load_cascade(name: str):
+    """Load a bundled Haar cascade once; None when OpenCV or the XML file is unavailable"""
+    if cv2 is None:
+        return None
+    try:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+    except Exception:
+        return None
+    return None if cascade.empty() else cascade
+
+
+# Parsed once at import; detectMultiScale is safe to call concurrently on separate inputs
+_FACE_CASCADE = face_cascade()
+_UPPER_CASCADE = _load_cascade('haarcascade_upperbody.xml')
+
+# Per-thread scratch arrays for grayscale/resized frames; the server's concurrency caps bound
+# how many worker threads (and so how many buffer sets) exist
+_TLS = threading.local()
+
+
+def _buffer(name: str, shape: Tuple[int, ...]) -> "np.ndarray":
+    """Reusable uint8 array for this thread, one per purpose; reallocated when the shape changes,
+    so a thread holds at most one array per purpose whatever resolutions clients send"""
+    bufs = getattr(_TLS, 'bufs', None)
+    if bufs is None:
+        bufs = _TLS.bufs = {}
+    buf = bufs.get(name)
+    if buf is None or buf.shape != shape:
+        buf = bufs[name] = np.empty(shape, dtype=np.uint8)
+    return buf
+
+
+def _decode(image: Union[bytes, "np.ndarray"]) -> "np.ndarray":
+    """Decode to BGR for YuNet, or straight to one grayscale channel for the Haar cascade"""
+    if isinstance(image, (bytes, bytearray)):
+        flag = cv2.IMREAD_COLOR if YUNET_AVAILABLE else cv2.IMREAD_GRAYSCALE
+        frame = cv2.imdecode(np.frombuffer(image, np.uint8), flag)
+        if frame is None:
+            raise ValueError("could not decode image")
+        return frame
+    return image if YUNET_AVAILABLE else _as_gray(image)
 
-def _detect_upper_body_opencv(image_bytes: bytes) -> Dict:
+
+def _as_gray(frame: "np.ndarray") -> "np.ndarray":
+    if frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=_buffer('gray', frame.shape[:2]))
+
+
+def _detect_faces(frame: "np.ndarray", scale_factor: float, min_neighbors: int, min_size, max_size=(0, 0)):
+    """Face boxes from YuNet when its model is available, else the Haar cascade with the given parameters"""
+    if YUNET_AVAILABLE:
+        faces = _yunet_faces(frame)
+        keep = (faces[:, 2] >= min_size[0]) & (faces[:, 3] >= min_size[1])
+        if max_size[0] and max_size[1]:
+            keep &= (faces[:, 2] <= max_size[0]) & (faces[:, 3] <= max_size[1])
+        return faces[keep]
+    return _FACE_CASCADE.detectMultiScale(_as_gray(frame), scale_factor, min_neighbors,
+                                          minSize=min_size, maxSize=max_size)
+
+
+def _fit(image: "np.ndarray", max_side: int = 480):
+    """_yunet.fit, resizing into this thread's reusable 'small' buffer"""
+    return fit(image, max_side, buffer=lambda shape: _buffer('small', shape))
+
+
+def simple_faces(frame: "np.ndarray") -> "np.ndarray":
+    """Face boxes for the lenient visibility check, as (N, 4) int32 x, y, w, h in pixels of frame;
+    also what FrameContext shares, so unified and standalone checks see the same faces"""
+    if _FACE_CASCADE is None and not YUNET_AVAILABLE:
+        return np.empty((0, 4), dtype=np.int32)
+    small, scale = _fit(frame)
+    h, w = small.shape[:2]
+    faces = _detect_faces(small, 1.05, 3, (20, 20), (w//2, h//2))
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.asarray(unscale_boxes(faces, scale), dtype=np.int32)
+
+
+def _detect_upper_body_opencv(image: Union[bytes, "np.ndarray"]) -> Dict:
     """Detect upper body visibility using OpenCV cascade classifiers"""
-    if cv2 is None or np is None or Image is None:
+    if (_FACE_CASCADE is None and not YUNET_AVAILABLE) or np is None:
         return {"upper_body_visible": True, "confidence": 0.8, "violation": False, "method": "fallback"}
     
     try:
-        # Convert bytes to image
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        cv_img = np.array(img)
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
+        frame = _decode(image)
+        
+        small, scale = _fit(frame)
         
         # Try to detect face first (indicates person is present)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(30, 30))
+        faces = _detect_faces(small, 1.1, 4, (30, 30))
+        if scale != 1.0 and len(faces) > 0:
+            faces = (faces / scale).astype(np.int32)  # back to full-resolution coordinates
         
-        # Also try upper body detection (with fallback if file doesn't exist)
-        try:
-            upper_body_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_upperbody.xml')
-            upper_bodies = upper_body_cascade.detectMultiScale(gray, 1.1, 3, minSize=(50, 50))
-        except:
+        # Upper body is only a secondary signal when no face was found, so skip its
+        # pyramid scan otherwise (and fall back if the cascade file doesn't exist)
+        if len(faces) == 0 and _UPPER_CASCADE is not None:
+            upper_bodies = _UPPER_CASCADE.detectMultiScale(_as_gray(small), 1.1, 3, minSize=(50, 50))
+        else:
             upper_bodies = []  # Fallback if upper body cascade not available
         
-        h, w = gray.shape
+        h, w = frame.shape[:2]
+        face_ratio = 0.0
         
         # If we detect a face, assume upper body is visible (more lenient approach)
         if len(faces) > 0:
             largest_face = max(faces, key=lambda f: f[2] * f[3])
             fx, fy, fw, fh = largest_face
-            face_area = fw * fh
-            total_area = h * w
-            face_ratio = face_area / total_area
+            face_ratio = float(fw * fh) / (h * w)
             
             # Check if face is positioned reasonably in the frame
             face_center_y = fy + fh // 2
@@ -94,11 +172,12 @@ def _detect_upper_body_opencv(image_bytes: bytes) -> Dict:
             "reason": reason,
             "debug_info": {
                 "image_size": f"{w}x{h}",
-                "face_ratio": face_area / total_area if len(faces) > 0 else 0
+                "face_ratio": face_ratio
             }
         }
     
     except Exception as e:
+        logger.warning("Upper body detection failed; reporting no violation", exc_info=True)
         return {
             "upper_body_visible": True,  # Default to no violation on error
             "confidence": 0.8,
@@ -108,23 +187,17 @@ def _detect_upper_body_opencv(image_bytes: bytes) -> Dict:
         }
 
 
-def _simple_body_visibility_check(image_bytes: bytes) -> Dict:
-    """Simple and lenient body visibility check"""
-    if cv2 is None or np is None or Image is None:
+def _simple_body_visibility_check(image: Union[bytes, "np.ndarray"], faces=None) -> Dict:
+    """Simple and lenient body visibility check; faces may carry boxes already detected on the frame"""
+    if (_FACE_CASCADE is None and not YUNET_AVAILABLE) or np is None:
         return {"upper_body_visible": True, "confidence": 0.9, "violation": False, "method": "simple_fallback"}
     
     try:
-        # Convert bytes to image
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        cv_img = np.array(img)
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        
-        h, w = gray.shape
-        
-        # Check for any face detection (very lenient)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.05, 3, minSize=(20, 20), maxSize=(w//2, h//2))
+        frame = None
+        if faces is None:
+            frame = _decode(image)
+            # Check for any face detection (very lenient)
+            faces = simple_faces(frame)
         
         # If we detect any face, assume body is visible
         if len(faces) > 0:
@@ -138,8 +211,12 @@ def _simple_body_visibility_check(image_bytes: bytes) -> Dict:
         
         # If no face detected, check for basic image content (not completely black/empty)
         # Calculate image brightness/activity
-        mean_brightness = np.mean(gray)
-        brightness_std = np.std(gray)
+        if frame is None:
+            frame = _decode(image)
+        # meanStdDev gets both statistics in a single pass over the frame
+        mean, std = cv2.meanStdDev(_as_gray(frame))
+        mean_brightness = float(mean[0, 0])
+        brightness_std = float(std[0, 0])
         
         # If there's reasonable image content, assume person is present but maybe looking away
         if mean_brightness > 10 and brightness_std > 5:  # Not a blank/black image
@@ -163,6 +240,7 @@ def _simple_body_visibility_check(image_bytes: bytes) -> Dict:
         }
         
     except Exception as e:
+        logger.warning("Body visibility check failed; reporting no violation", exc_info=True)
         return {
             "upper_body_visible": True,  # Always default to no violation on error
             "confidence": 0.9,
@@ -172,8 +250,8 @@ def _simple_body_visibility_check(image_bytes: bytes) -> Dict:
         }
 
 
-def infer_body_visibility(image_bytes: bytes) -> Dict:
-    """Infer body visibility from image bytes - using simple, lenient approach"""
-    return _simple_body_visibility_check(image_bytes)
+def infer_body_visibility(image: Union[bytes, "np.ndarray"], faces=None) -> Dict:
+    """Infer body visibility from image bytes or a decoded BGR frame - using simple, lenient approach"""
+    return _simple_body_visibility_check(image, faces)
 
 
@@ -0,0 +1,38 @@
+from dataclasses import dataclass, field
+from typing import Optional, Union
+import numpy as np
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+from ._jpeg import decode_image
+from .body_visibility import simple_faces
+
+
+@dataclass
+class FrameContext:
+    """One decoded frame and its face boxes, shared by every detector in a unified request"""
+    bgr: np.ndarray
+    _faces: Optional[np.ndarray] = field(default=None, repr=False)
+
+    @property
+    def faces(self) -> np.ndarray:
+        """(N, 4) int32 x, y, w, h in pixels of bgr, detected on first access"""
+        if self._faces is None:
+            self._faces = simple_faces(self.bgr)
+        return self._faces
+
+
+def build_frame_context(image: Union[bytes, np.ndarray]) -> Optional[FrameContext]:
+    """Decode image (BGR frames pass through); faces are detected once, when first needed.
+    None if it cannot be decoded"""
+    if cv2 is None:
+        return None
+    if isinstance(image, np.ndarray):
+        bgr = image
+    else:
+        bgr = decode_image(image)
+        if bgr is None:
+            return None
+    return FrameContext(bgr=bgr)
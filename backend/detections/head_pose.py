@@ -1,13 +1,30 @@
-from typing import Dict
-from .head_pose_model import infer_head_pose_trained
+from typing import Any, Dict, List, Optional, Union
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .head_pose_model import infer_head_pose_trained, infer_head_pose_trained_batch
 from .head_pose_mediapipe import infer_head_pose_mediapipe
 
 
-def infer_head_pose(image_bytes: bytes) -> Dict:
-    res = infer_head_pose_trained(image_bytes)
+def infer_head_pose(image: Union[bytes, "np.ndarray"], faces=None, user_id: Any = None) -> Dict:
+    """Accepts encoded image bytes or an already-decoded BGR frame; pass faces to
+    reuse (x, y, w, h) boxes already detected on the frame, and user_id to let the
+    MediaPipe fallback track that user's face across frames"""
+    res = infer_head_pose_trained(image, faces=faces)
     if res.get("using_trained"):
         return res
     # fallback to CPU MediaPipe
-    return infer_head_pose_mediapipe(image_bytes)
+    return infer_head_pose_mediapipe(image, faces=faces, user_id=user_id)
 
 
+def infer_head_pose_batch(images: List[Union[bytes, "np.ndarray"]], user_ids: Optional[List[Any]] = None) -> List[Dict]:
+    """Run head pose inference over a batch of frames, returning one result per frame"""
+    if user_ids is None:
+        user_ids = [None] * len(images)
+    results = infer_head_pose_trained_batch(images)
+    return [
+        res if res.get("using_trained") else infer_head_pose_mediapipe(image, user_id=user_id)
+        for res, image, user_id in zip(results, images, user_ids)
+    ]
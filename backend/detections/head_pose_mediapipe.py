@@ -1,5 +1,7 @@
-import io
-from typing import Dict, Optional, Tuple
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
 
 try:
     import cv2
@@ -9,110 +11,167 @@ try:
     import numpy as np
 except Exception:
     np = None
-try:
-    from PIL import Image
-except Exception:
-    Image = None
 
 try:
     import mediapipe as mp
 except Exception:  # pragma: no cover
     mp = None
 
+from ._yunet import YUNET_AVAILABLE, detect_faces as _yunet_faces, face_cascade, fit, njit
+
 
 _face_mesh = None
+_face_mesh_lock = threading.Lock()
+
+# Tracking-mode FaceMesh per user: consecutive frames from one webcam reuse the previous
+# landmarks instead of re-running face detection. Least recently seen users are evicted.
+_FM_MAX_USERS = int(os.environ.get('HEAD_POSE_FACEMESH_USERS', '64'))
+_fm_by_user: "OrderedDict[Any, Tuple[Any, threading.Lock]]" = OrderedDict()
+_fm_by_user_lock = threading.Lock()
+
+# Select 2D-3D correspondences (rough, standard indices)
+# Nose tip (1), Chin (152), Left eye corner (263), Right eye corner (33), Left mouth corner (287), Right mouth corner (57)
+_IDXS = (1, 152, 263, 33, 287, 57)
+_PTS_3D = None if np is None else np.array([
+    [0.0, 0.0, 0.0],      # nose
+    [0.0, -63.6, -12.5],  # chin
+    [43.3, 32.7, -26.0],  # left eye corner
+    [-43.3, 32.7, -26.0], # right eye corner
+    [28.9, -28.9, -24.1], # left mouth
+    [-28.9, -28.9, -24.1] # right mouth
+], dtype=np.float64)
+_DIST_COEFFS = None if np is None else np.zeros((4, 1))
 
 
-def _get_face_mesh():
+def _get_face_mesh(user_id: Any = None):
+    """(FaceMesh, lock) for this user; frames without a usable user_id share one static-image instance.
+    FaceMesh is stateful and not thread-safe, so process() must run under the returned lock."""
     global _face_mesh
-    if _face_mesh is None and mp is not None:
-        _face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
-    return _face_mesh
+    if mp is None:
+        return None, None
+    if not isinstance(user_id, (str, int)):
+        if _face_mesh is None:
+            # Double-checked so concurrent first requests build a single graph
+            with _face_mesh_lock:
+                if _face_mesh is None:
+                    _face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
+        return _face_mesh, _face_mesh_lock
 
+    evicted = []
+    with _fm_by_user_lock:
+        entry = _fm_by_user.get(user_id)
+        if entry is not None:
+            _fm_by_user.move_to_end(user_id)
+        else:
+            fm = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=True)
+            entry = _fm_by_user[user_id] = (fm, threading.Lock())
+            while len(_fm_by_user) > _FM_MAX_USERS:
+                evicted.append(_fm_by_user.popitem(last=False)[1])
+    # Close outside the registry lock; waits for any in-flight process() on that instance
+    for old_fm, old_lock in evicted:
+        with old_lock:
+            old_fm.close()
+    return entry
 
-def _bytes_to_bgr(image_bytes: bytes) -> Optional[np.ndarray]:
-    try:
-        if Image is None:
-            return None
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-    except Exception:
+
+def _bytes_to_bgr(image: Union[bytes, "np.ndarray"]) -> Optional[np.ndarray]:
+    # Already-decoded BGR frames pass through
+    if not isinstance(image, (bytes, bytearray)):
+        return image
+    if not image or np is None or cv2 is None:
         return None
-    if np is None or cv2 is None:
+    # imdecode emits BGR directly; None on undecodable input
+    try:
+        return cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
         return None
-    arr = np.array(img)
-    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
 
 
-def _estimate_head_pose(bgr: np.ndarray) -> Optional[Tuple[float, float]]:
-    fm = _get_face_mesh()
+@njit(cache=True)
+def _rvec_to_yaw_pitch(rvec):
+    """Closed-form Rodrigues vector -> (yaw, pitch) in degrees, without building the matrix via cv2.Rodrigues"""
+    theta = np.sqrt(rvec[0] * rvec[0] + rvec[1] * rvec[1] + rvec[2] * rvec[2])
+    if theta < 1e-12:
+        return 0.0, 0.0
+    kx = rvec[0] / theta
+    ky = rvec[1] / theta
+    kz = rvec[2] / theta
+    c = np.cos(theta)
+    s = np.sin(theta)
+    t = 1.0 - c
+    r00 = c + kx * kx * t
+    r10 = kx * ky * t + kz * s
+    r20 = kx * kz * t - ky * s
+    sy = np.sqrt(r00 * r00 + r10 * r10)
+    if sy >= 1e-6:
+        x = np.arctan2(ky * kz * t + kx * s, c + kz * kz * t)
+    else:
+        x = np.arctan2(-(ky * kz * t - kx * s), c + ky * ky * t)
+    y = np.arctan2(-r20, sy)
+    return np.degrees(y), np.degrees(x)
+
+
+# Compile at import so the first request doesn't pay the JIT cost
+_rvec_to_yaw_pitch(np.array([0.1, 0.1, 0.1]))
+
+
+def _estimate_head_pose(bgr: np.ndarray, user_id: Any = None) -> Optional[Tuple[float, float]]:
+    fm, fm_lock = _get_face_mesh(user_id)
     if fm is None:
         return None
 
     if cv2 is None:
         return None
-    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-    res = fm.process(rgb)
+    # Landmarks are normalized, so FaceMesh can run on a downscaled copy while the
+    # PnP points and camera matrix below keep using the original w, h
+    small, _ = fit(bgr)
+    rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    with fm_lock:
+        res = fm.process(rgb)
     if not res.multi_face_landmarks:
         return None
 
     h, w = bgr.shape[:2]
     lms = res.multi_face_landmarks[0].landmark
 
-    # Select 2D-3D correspondences (rough, standard indices)
-    # Nose tip (1), Chin (152), Left eye corner (263), Right eye corner (33), Left mouth corner (287), Right mouth corner (57)
-    idxs = [1, 152, 263, 33, 287, 57]
-    pts_2d = np.array([[lms[i].x * w, lms[i].y * h] for i in idxs], dtype=np.float64)
-    pts_3d = np.array([
-        [0.0, 0.0, 0.0],      # nose
-        [0.0, -63.6, -12.5],  # chin
-        [43.3, 32.7, -26.0],  # left eye corner
-        [-43.3, 32.7, -26.0], # right eye corner
-        [28.9, -28.9, -24.1], # left mouth
-        [-28.9, -28.9, -24.1] # right mouth
-    ], dtype=np.float64)
+    # Allocated per call: the estimator runs on several worker threads at once
+    pts_2d = np.empty((6, 2), dtype=np.float64)
+    for k, i in enumerate(_IDXS):
+        pts_2d[k, 0] = lms[i].x * w
+        pts_2d[k, 1] = lms[i].y * h
 
     focal_length = w
     cam_matrix = np.array([[focal_length, 0, w / 2], [0, focal_length, h / 2], [0, 0, 1]], dtype=np.float64)
-    dist_coeffs = np.zeros((4, 1))
 
-    success, rvec, tvec = cv2.solvePnP(pts_3d, pts_2d, cam_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+    success, rvec, tvec = cv2.solvePnP(_PTS_3D, pts_2d, cam_matrix, _DIST_COEFFS, flags=cv2.SOLVEPNP_ITERATIVE)
     if not success:
         return None
 
-    rmat, _ = cv2.Rodrigues(rvec)
-    sy = np.sqrt(rmat[0, 0] * rmat[0, 0] + rmat[1, 0] * rmat[1, 0])
-    singular = sy < 1e-6
-    if not singular:
-        x = np.arctan2(rmat[2, 1], rmat[2, 2])
-        y = np.arctan2(-rmat[2, 0], sy)
-        z = np.arctan2(rmat[1, 0], rmat[0, 0])
-    else:
-        x = np.arctan2(-rmat[1, 2], rmat[1, 1])
-        y = np.arctan2(-rmat[2, 0], sy)
-        z = 0
+    yaw, pitch = _rvec_to_yaw_pitch(rvec.ravel())
+    return float(yaw), float(pitch)
 
-    pitch = np.degrees(x)
-    yaw = np.degrees(y)
-    return yaw, pitch
 
-
-def _opencv_fallback_pose(bgr: np.ndarray) -> Dict:
-    """Simple OpenCV-based head pose estimation using face detection"""
+def _opencv_fallback_pose(bgr: np.ndarray, faces: Optional[np.ndarray] = None) -> Dict:
+    """Simple OpenCV-based head pose estimation using face detection.
+    Pass full-resolution face boxes to reuse a detection already made for this frame."""
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
-        
-        # Load cascade classifier
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        if faces is not None:
+            scale = 1.0
+        else:
+            # Downscale first so face detection touches fewer pixels
+            small, scale = fit(bgr)
+            
+            # Detect faces; YuNet works on BGR directly, the cascade needs grayscale
+            if YUNET_AVAILABLE:
+                faces = _yunet_faces(small)
+            else:
+                faces = face_cascade().detectMultiScale(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), 1.1, 4)
         
         if len(faces) == 0:
             return {"pose": "unknown", "confidence": 0.0, "violation": False, "using_mediapipe": False}
         
-        # Use the largest face
-        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        # Use the largest face, mapped back to full-resolution coordinates
+        x, y, w, h = (v / scale for v in max(faces, key=lambda face: face[2] * face[3]))
         
         # Simple heuristic for head pose based on face position
         img_center_x = bgr.shape[1] // 2
@@ -170,15 +229,16 @@ def _opencv_fallback_pose(bgr: np.ndarray) -> Dict:
             "error": str(e)
         }
 
-def infer_head_pose_mediapipe(image_bytes: bytes) -> Dict:
-    bgr = _bytes_to_bgr(image_bytes)
+def infer_head_pose_mediapipe(image: Union[bytes, "np.ndarray"], faces: Optional[np.ndarray] = None,
+                              user_id: Any = None) -> Dict:
+    bgr = _bytes_to_bgr(image)
     if bgr is None:
         return {"pose": "forward", "head_pose": "forward", "confidence": 0.3, "violation": False, "using_mediapipe": False}
     
     # Try MediaPipe first if available
     if mp is not None:
         try:
-            est = _estimate_head_pose(bgr)
+            est = _estimate_head_pose(bgr, user_id)
             if est is not None:
                 yaw, pitch = est
                 # Simple rule-based classification
@@ -208,7 +268,7 @@ def infer_head_pose_mediapipe(image_bytes: bytes) -> Dict:
             pass  # Fall back to OpenCV
     
     # Fall back to OpenCV-based detection
-    return _opencv_fallback_pose(bgr)
+    return _opencv_fallback_pose(bgr, faces)
 
 
 
@@ -1,9 +1,30 @@
-import io
 import os
 import json
-from typing import Dict, Optional
+import itertools
+import logging
+import threading
+import traceback
+from typing import Dict, List, Optional, Union
 
+try:
+    import cv2
+    import numpy as np
+    _HAS_CV = True
+except ImportError:
+    cv2 = None
+    np = None
+    _HAS_CV = False
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
 
+from ._jpeg import decode_image
+from ._result_cache import ResultCache
+from ._yunet import YUNET_AVAILABLE, detect_faces, face_cascade, fit, unscale_boxes
+
+
+logger = logging.getLogger(__name__)
 
 MODEL_PATH = os.environ.get(
     'HEAD_POSE_MODEL_PATH',
@@ -14,22 +35,180 @@ MODEL_INFO_PATH = os.environ.get(
     os.path.join(os.path.dirname(__file__), '..', 'models', 'head_pose_mobilenet_info.json')
 )
 CLASSES_DEFAULT = ["forward", "left", "right", "down", "up"]
+# An exported ONNX model next to the .h5 (or at HEAD_POSE_ONNX_PATH) is preferred when onnxruntime is installed
+ONNX_PATH = os.environ.get('HEAD_POSE_ONNX_PATH')
+# ORT releases the GIL in run(), so a small pool of single-threaded sessions gives real parallelism
+# across worker threads; keep it in line with the head-pose concurrency cap in the server
+ORT_SESSIONS = int(os.environ.get('HEAD_POSE_ORT_SESSIONS', min(4, os.cpu_count() or 1)))
+# HEAD_POSE_QUANTIZED=1 serves a dynamic-range (int8 weight) TFLite conversion of the Keras model,
+# cached as <model>_quant.tflite (or HEAD_POSE_TFLITE_PATH) after the first conversion
+QUANTIZED = os.environ.get('HEAD_POSE_QUANTIZED') == '1'
+TFLITE_PATH = os.environ.get('HEAD_POSE_TFLITE_PATH')
+# A SavedModel export (<model>_savedmodel/ or HEAD_POSE_SAVEDMODEL_PATH) loads faster than the .h5;
+# see export_head_pose_savedmodel.py
+SAVEDMODEL_PATH = os.environ.get('HEAD_POSE_SAVEDMODEL_PATH')
+# Frames per forward pass in infer_head_pose_trained_batch
+BATCH_SIZE = max(1, int(os.environ.get('HEAD_POSE_BATCH', 8)))
 
 
 _model = None
 _img_size = 160
 _classes = CLASSES_DEFAULT
 _last_model_error: str | None = None
+_sessions: list = []
+_session_input: str | None = None
+_session_rr = itertools.count()
+_predict_fn = None
+# True when the Keras model's head has no softmax, so outputs are logits
+_outputs_logits = False
+# Loading is attempted once per process; inference calls only check the flag
+_load_attempted = False
+_load_lock = threading.Lock()
+_tflite_content: bytes | None = None
+_tflite_interpreter = None
+# Per-thread state: the tf.lite.Interpreter (not thread-safe) and the preprocessing buffers
+_tls = threading.local()
+# Results for re-submitted identical frames
+_result_cache = ResultCache()
+# The cascade scans a copy of the frame scaled to at most this many pixels on its longer side
+CASCADE_MAX_DIM = 320
 
 
-def _load_model_if_available():
-    global _model, _img_size, _classes, _last_model_error
-    print(f"Loading model from: {MODEL_PATH}")
+def _load_model_info():
+    global _img_size, _classes
+    model_info_path = MODEL_INFO_PATH
+    if not os.path.exists(model_info_path):
+        # Try to find info in same directory as model
+        model_info_path = MODEL_PATH.replace('.h5', '_info.json')
     
-    # Check if model is already loaded
-    if _model is not None:
-        print("Model already loaded")
+    if os.path.exists(model_info_path):
+        try:
+            with open(model_info_path, 'r') as f:
+                model_info = json.load(f)
+            _classes = model_info.get('classes', CLASSES_DEFAULT)
+            _img_size = model_info.get('img_size', 160)
+            logger.info("Loaded model info: classes=%s, img_size=%s", _classes, _img_size)
+        except Exception as e:
+            logger.warning("Error loading model info: %s", e)
+            _classes = CLASSES_DEFAULT
+            _img_size = 160
+    else:
+        _classes = CLASSES_DEFAULT
+        _img_size = 160
+        logger.info("Using default model info: classes=%s, img_size=%s", _classes, _img_size)
+
+
+def _load_onnx_sessions(onnx_path: str) -> bool:
+    """Create the ONNX Runtime session pool; False if onnxruntime or the model is unavailable"""
+    global _sessions, _session_input
+    if ort is None or not os.path.exists(onnx_path):
+        return False
+    try:
+        so = ort.SessionOptions()
+        # One thread per session: the server's semaphore, not ORT, decides how many run at once
+        so.intra_op_num_threads = 1
+        so.inter_op_num_threads = 1
+        # Constant folding and conv/BN/activation fusion on the exported graph
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sessions = [
+            ort.InferenceSession(onnx_path, sess_options=so, providers=['CPUExecutionProvider'])
+            for _ in range(max(1, ORT_SESSIONS))
+        ]
+    except Exception as e:
+        logger.warning("Error loading ONNX model: %s", e)
+        return False
+    _session_input = sessions[0].get_inputs()[0].name
+    _sessions = sessions
+    logger.info("ONNX model loaded from %s (%d sessions)", onnx_path, len(sessions))
+    return True
+
+
+def _build_predict_fn(tf, model):
+    """XLA-compiled forward pass with a fixed input signature; None if compilation fails"""
+    fn = tf.function(
+        lambda x: model(x, training=False),
+        jit_compile=True,
+        input_signature=[tf.TensorSpec((None, _img_size, _img_size, 3), tf.float32)],
+    )
+    try:
+        # Trace and compile at load time instead of on the first request
+        fn(tf.zeros((1, _img_size, _img_size, 3), tf.float32))
+    except Exception as e:
+        logger.info("XLA compilation unavailable, calling the model directly: %s", e)
+        return None
+    return fn
+
+
+def _load_tflite(tf, model) -> bool:
+    """Load the quantized TFLite model, converting the Keras model (and caching the result) first if needed"""
+    global _tflite_content, _tflite_interpreter
+    path = TFLITE_PATH or os.path.splitext(MODEL_PATH)[0] + '_quant.tflite'
+    try:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+        else:
+            converter = tf.lite.TFLiteConverter.from_keras_model(model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            content = converter.convert()
+            try:
+                with open(path, 'wb') as f:
+                    f.write(content)
+            except OSError as e:
+                logger.warning("Could not cache quantized model at %s: %s", path, e)
+    except Exception as e:
+        logger.warning("Error preparing quantized model: %s", e)
+        return False
+    _tflite_content = content
+    _tflite_interpreter = tf.lite.Interpreter
+    logger.info("Quantized TFLite model ready (%d bytes)", len(content))
+    return True
+
+
+def _tflite_predict(inp):
+    interp = getattr(_tls, 'interpreter', None)
+    if interp is None:
+        interp = _tls.interpreter = _tflite_interpreter(model_content=_tflite_content)
+        interp.allocate_tensors()
+    in_idx = interp.get_input_details()[0]['index']
+    if tuple(interp.get_input_details()[0]['shape']) != inp.shape:
+        interp.resize_tensor_input(in_idx, inp.shape)
+        interp.allocate_tensors()
+    interp.set_tensor(in_idx, inp)
+    interp.invoke()
+    return interp.get_tensor(interp.get_output_details()[0]['index'])
+
+
+def _predict(inp):
+    """Class probabilities for a preprocessed batch, via the ORT pool when loaded, else Keras"""
+    inp = inp.astype('float32', copy=False)
+    if _sessions:
+        session = _sessions[next(_session_rr) % len(_sessions)]
+        return session.run(None, {_session_input: inp})[0]
+    if _tflite_content is not None:
+        return _tflite_predict(inp)
+    if _predict_fn is not None:
+        return _predict_fn(inp).numpy()
+    # Direct call skips predict()'s per-call data adapter, callbacks and batching machinery
+    return _model(inp, training=False).numpy()
+
+
+def _load_model_if_available():
+    global _load_attempted
+    if _load_attempted:
         return
+    with _load_lock:
+        if _load_attempted:
+            return
+        try:
+            _load_model()
+        finally:
+            _load_attempted = True
+
+
+def _load_model():
+    global _model, _predict_fn, _last_model_error, _outputs_logits
+    logger.info("Loading model from: %s", MODEL_PATH)
     
     # Check if model file exists
     if not os.path.exists(MODEL_PATH):
@@ -42,157 +221,206 @@ def _load_model_if_available():
         
         for alt_path in alt_paths:
             if os.path.exists(alt_path):
-                print(f"Found model at alternative path: {alt_path}")
+                logger.info("Found model at alternative path: %s", alt_path)
                 globals()['MODEL_PATH'] = alt_path
                 break
-        
-        # If still not found, report error
-        if not os.path.exists(MODEL_PATH):
-            _last_model_error = f"Model file not found at {MODEL_PATH} or any alternative locations"
-            print(f"Error: {_last_model_error}")
-            return
-    
-    print(f"Model exists: {os.path.exists(MODEL_PATH)}")
+
+    # Prefer the ONNX export when available (unless quantization was requested); Keras is only needed as the fallback
+    if not QUANTIZED and _load_onnx_sessions(ONNX_PATH or os.path.splitext(MODEL_PATH)[0] + '.onnx'):
+        _load_model_info()
+        _last_model_error = None
+        return
+
+    savedmodel_path = SAVEDMODEL_PATH or os.path.splitext(MODEL_PATH)[0] + '_savedmodel'
+
+    # If still not found, report error
+    if not os.path.exists(MODEL_PATH) and not os.path.isdir(savedmodel_path):
+        _last_model_error = f"Model file not found at {MODEL_PATH} or any alternative locations"
+        logger.error("%s", _last_model_error)
+        return
     
     try:
         import tensorflow as tf
-        print("TensorFlow imported successfully")
         from tensorflow import keras
         
+        # Prefer the SavedModel export; its variables are read through TF's file system layer
+        # instead of materialising the whole HDF5 file first
+        if os.path.isdir(savedmodel_path):
+            try:
+                _model = keras.models.load_model(
+                    savedmodel_path,
+                    options=tf.saved_model.LoadOptions(experimental_io_device='/job:localhost'),
+                )
+                logger.info("Model loaded from SavedModel %s", savedmodel_path)
+            except Exception as e:
+                # Keras 3 cannot load TF SavedModels as Keras models; use the .h5 instead
+                logger.warning("Could not load SavedModel, falling back to %s: %s", MODEL_PATH, e)
+                _model = None
+
         # Load model with error handling
         try:
-            _model = keras.models.load_model(MODEL_PATH)
-            print("Model loaded successfully")
+            if _model is None:
+                _model = keras.models.load_model(MODEL_PATH)
+                logger.info("Model loaded successfully")
         except Exception as e:
-            print(f"Error loading model: {str(e)}")
-            import traceback
+            logger.error("Error loading model: %s", e)
             _last_model_error = f"Error loading model: {str(e)}\n{traceback.format_exc()[:500]}"
             return
 
         # Load model info if available
-        model_info_path = MODEL_INFO_PATH
-        if not os.path.exists(model_info_path):
-            # Try to find info in same directory as model
-            model_info_path = MODEL_PATH.replace('.h5', '_info.json')
-        
-        if os.path.exists(model_info_path):
-            try:
-                with open(model_info_path, 'r') as f:
-                    model_info = json.load(f)
-                _classes = model_info.get('classes', CLASSES_DEFAULT)
-                _img_size = model_info.get('img_size', 160)
-                print(f"Loaded model info: classes={_classes}, img_size={_img_size}")
-            except Exception as e:
-                print(f"Error loading model info: {str(e)}")
-                _classes = CLASSES_DEFAULT
-                _img_size = 160
-        else:
-            _classes = CLASSES_DEFAULT
-            _img_size = 160
-            print(f"Using default model info: classes={_classes}, img_size={_img_size}")
+        _load_model_info()
+
+        activation = getattr(_model.layers[-1], 'activation', None)
+        _outputs_logits = getattr(activation, '__name__', 'softmax') != 'softmax'
+
+        if not (QUANTIZED and _load_tflite(tf, _model)):
+            _predict_fn = _build_predict_fn(tf, _model)
 
         _last_model_error = None
     except Exception as e:
         # If tensorflow/keras not available, keep _model as None to disable trained path
         _model = None
-        import traceback
         _last_model_error = f"Error in model loading process: {str(e)}\n{traceback.format_exc()[:500]}"
-        print(f"Exception during model loading: {str(e)}")
+        logger.error("Exception during model loading: %s", e)
 
 
-def _preprocess(image_bytes: bytes):
-    # Decode
-    try:
-        from PIL import Image
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-    except Exception:
+def _cascade_faces(cv_img):
+    """Haar-cascade face boxes in full-resolution coordinates, detected on a downscaled gray copy"""
+    small, scale = fit(cv_img, CASCADE_MAX_DIM)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    # Coarser pyramid and a minimum size suited to the smaller image
+    faces = face_cascade().detectMultiScale(gray, scaleFactor=1.3, minNeighbors=4, minSize=(48, 48))
+    return unscale_boxes(faces, scale)
+
+
+def _buffer(name: str, shape, dtype) -> "np.ndarray":
+    """Reusable array for this thread, keyed by purpose and shape"""
+    bufs = getattr(_tls, 'bufs', None)
+    if bufs is None:
+        bufs = _tls.bufs = {}
+    buf = bufs.get((name, shape))
+    if buf is None:
+        buf = bufs[(name, shape)] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def _preprocess(image: Union[bytes, "np.ndarray"], faces=None, out=None):
+    """Model input for one frame, written into out (an (img_size, img_size, 3) float32 slot)
+    or this thread's single-frame buffer; the result is overwritten by the next call"""
+    if not _HAS_CV:
         return None
+    # Decode straight to a BGR array; already-decoded BGR frames pass through
+    if isinstance(image, (bytes, bytearray)):
+        cv_img = decode_image(image)
+        if cv_img is None:
+            return None
+    else:
+        cv_img = image
 
-    # Convert to OpenCV for face detection
-    try:
-        import numpy as np
-        import cv2
-        cv_img = np.array(img)[:, :, ::-1]
-        gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.2, 5)
-    except Exception:
-        # If numpy/opencv unavailable, skip face cropping
-        faces = []
-        import numpy as np  # ensure cv_img exists for later conversion without cv2
-        cv_img = np.array(img)[:, :, ::-1]
+    # Face detection with OpenCV, unless the caller already has face boxes for this frame
+    if faces is None and YUNET_AVAILABLE:
+        # One YuNet forward pass on the colour frame; no grayscale copy needed
+        faces = detect_faces(cv_img)
+    elif faces is None:
+        try:
+            faces = _cascade_faces(cv_img)
+        except Exception:
+            # If opencv unavailable, skip face cropping
+            faces = []
     if len(faces) > 0:
         x, y, w, h = max(faces, key=lambda b: b[2] * b[3])
         x0 = max(0, x - int(0.15 * w))
         y0 = max(0, y - int(0.15 * h))
         x1 = min(cv_img.shape[1], x + w + int(0.15 * w))
         y1 = min(cv_img.shape[0], y + h + int(0.15 * h))
+        # Slicing is a view; the resize below is the first copy of the crop
         cv_img = cv_img[y0:y1, x0:x1]
 
-    # Back to PIL
     try:
-        import cv2
-        from PIL import Image
-        img = Image.fromarray(cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB))
+        size = (_img_size, _img_size, 3)
+        if out is None:
+            out = _buffer('input', size, np.float32)
+        # Resize first so the colour conversion and scaling only touch the model-sized image
+        resized = cv2.resize(cv_img, (_img_size, _img_size), dst=_buffer('resized', size, np.uint8), interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=_buffer('rgb', size, np.uint8))
+
+        # Normalize into the float buffer and add batch dimension
+        np.multiply(rgb, 1 / 255.0, out=out, dtype=np.float32)
+        return out[None]
     except Exception:
-        from PIL import Image
-        img = Image.fromarray(cv_img[:, :, ::-1])
+        return None
 
-    try:
-        import numpy as np
-        # Resize image
-        img = img.resize((_img_size, _img_size))
 
-        # Convert to array and normalize
-        img_array = np.array(img) / 255.0
+def _model_type() -> str:
+    return "MobileNet ONNX" if _sessions else "MobileNet TFLite int8" if _tflite_content else "MobileNet H5"
 
-        # Add batch dimension
-        img_tensor = np.expand_dims(img_array, axis=0)
 
-        return img_tensor
-    except Exception:
-        return None
+def _result(probabilities) -> Dict:
+    # Get predicted class and confidence
+    predicted_class_idx = int(np.argmax(probabilities))
+    predicted_direction = _classes[predicted_class_idx]
+    if _outputs_logits:
+        # Softmax probability of the winning class only: 1 / sum(exp(logit - max_logit))
+        confidence = float(1.0 / np.exp(probabilities - probabilities[predicted_class_idx]).sum())
+    else:
+        confidence = float(probabilities[predicted_class_idx])
+
+    # Consider it a violation if looking away with high confidence
+    violation = predicted_direction in ("left", "right", "down") and confidence >= 0.6
 
+    return {
+        "direction": predicted_direction,
+        "head_pose": predicted_direction,
+        "confidence": confidence,
+        "violation": violation,
+        "using_trained": True,
+        "model_type": _model_type()
+    }
 
-def infer_head_pose_trained(image_bytes: bytes) -> Dict:
+
+def infer_head_pose_trained_batch(images: List[Union[bytes, "np.ndarray"]], faces: Optional[List] = None) -> List[Dict]:
+    """Batched infer_head_pose_trained: frames are preprocessed individually and
+    classified HEAD_POSE_BATCH at a time in a single forward pass each"""
     _load_model_if_available()
-    if _model is None:
-        return {"direction": "forward", "head_pose": "forward", "confidence": 0.0, "violation": False, "using_trained": False, "model_error": _last_model_error}
-    inp = _preprocess(image_bytes)
-    if inp is None:
-        return {"direction": "unknown", "head_pose": "unknown", "confidence": 0.0, "violation": False, "using_trained": False, "model_error": _last_model_error}
+    if _model is None and not _sessions:
+        return [{"direction": "forward", "head_pose": "forward", "confidence": 0.0, "violation": False, "using_trained": False, "model_error": _last_model_error} for _ in images]
+    if faces is None:
+        faces = [None] * len(images)
+    keys = [_result_cache.key(image) for image in images]
+    results: List[Optional[Dict]] = [_result_cache.get(key) for key in keys]
+    pending = [i for i, res in enumerate(results) if res is None]
     try:
-        import numpy as np
-        # Make prediction
-        predictions = _model.predict(inp, verbose=0)
-        probabilities = predictions[0]
-
-        # Get predicted class and confidence
-        predicted_class_idx = np.argmax(probabilities)
-        predicted_direction = _classes[predicted_class_idx]
-        confidence = float(probabilities[predicted_class_idx])
-
-        # Consider it a violation if looking away with high confidence
-        violation = predicted_direction in ("left", "right", "down") and confidence >= 0.6
-        
-        return {
-            "direction": predicted_direction,
-            "head_pose": predicted_direction,
-            "confidence": confidence,
-            "violation": violation,
-            "using_trained": True,
-            "model_type": "MobileNet H5"
-        }
-    except Exception as e:
-        import traceback
+        # Frames are preprocessed straight into this thread's batch tensor
+        batch = _buffer('batch', (BATCH_SIZE, _img_size, _img_size, 3), np.float32)
+        for start in range(0, len(pending), BATCH_SIZE):
+            idxs = []
+            for i in pending[start:start + BATCH_SIZE]:
+                if _preprocess(images[i], faces[i], out=batch[len(idxs)]) is None:
+                    results[i] = {"direction": "unknown", "head_pose": "unknown", "confidence": 0.0, "violation": False, "using_trained": False, "model_error": _last_model_error}
+                else:
+                    idxs.append(i)
+            if not idxs:
+                continue
+            predictions = _predict(batch[:len(idxs)])
+            for i, probabilities in zip(idxs, predictions):
+                results[i] = _result(probabilities)
+                _result_cache.put(keys[i], results[i])
+    except Exception:
         error_msg = traceback.format_exc()[:1000]
-        return {
-            "direction": "unknown",
-            "head_pose": "unknown",
-            "confidence": 0.0,
-            "violation": False,
-            "using_trained": False,
-            "error": error_msg
-        }
+        for i in pending:
+            if results[i] is None:
+                results[i] = {
+                    "direction": "unknown",
+                    "head_pose": "unknown",
+                    "confidence": 0.0,
+                    "violation": False,
+                    "using_trained": False,
+                    "error": error_msg
+                }
+    return results
 
 
+def infer_head_pose_trained(image: Union[bytes, "np.ndarray"], faces=None) -> Dict:
+    """Accepts encoded image bytes or an already-decoded BGR frame, plus optional
+    full-resolution (x, y, w, h) face boxes already detected on it"""
+    return infer_head_pose_trained_batch([image], [faces])[0]
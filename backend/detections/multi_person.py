@@ -1,9 +1,13 @@
-from typing import Dict
-from .multi_person_improved import infer_multi_person_improved
+from typing import Dict, List, Union
+import numpy as np
+from .multi_person_improved import infer_multi_person_improved, infer_multi_person_improved_batch
 
 
-def infer_multi_person(image_bytes: bytes) -> Dict:
+def infer_multi_person(image: Union[bytes, np.ndarray]) -> Dict:
     """Improved multi-person detection with better accuracy and debugging"""
-    return infer_multi_person_improved(image_bytes)
+    return infer_multi_person_improved(image)
 
 
+def infer_multi_person_batch(images: List[Union[bytes, np.ndarray]]) -> List[Dict]:
+    """Multi-person detection over several frames, one result per frame"""
+    return infer_multi_person_improved_batch(images)
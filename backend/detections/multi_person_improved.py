@@ -1,14 +1,58 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import base64
-import io
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from PIL import Image
 
 try:
-    from ultralytics import YOLO
+    import torch
 except ImportError:
-    YOLO = None
+    torch = None
+
+if torch is not None:
+    # Leave cores for the request threads and the other detectors
+    torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+# FP16 only pays off (and is only supported by Ultralytics) on CUDA
+_HALF = torch is not None and torch.cuda.is_available()
+
+try:
+    from numba import njit
+except Exception:
+    njit = None
+
+from ._jpeg import decode_image
+from ._model_registry import IMGSZ, YOLO, registry
+from ._result_cache import cached_by_content
+
+logger = logging.getLogger(__name__)
+
+
+def _filter_boxes(boxes, width, height, out_mask):
+    """Same rules as ImprovedMultiPersonDetector._person_mask, one box at a time; returns the kept count"""
+    margin = 0.02
+    kept = 0
+    for i in range(boxes.shape[0]):
+        det_width = boxes[i, 2] - boxes[i, 0]
+        det_height = boxes[i, 3] - boxes[i, 1]
+        center_x = (boxes[i, 0] + boxes[i, 2]) * 0.5
+        center_y = (boxes[i, 1] + boxes[i, 3]) * 0.5
+        aspect_ratio = det_height / max(det_width, 1e-6)
+        ok = (
+            det_width >= 12 and det_height >= 24
+            and det_width <= width * 0.95 and det_height <= height * 0.95
+            and 0.8 <= aspect_ratio <= 6.0
+            and width * margin <= center_x <= width * (1 - margin)
+            and height * margin <= center_y <= height * (1 - margin)
+        )
+        out_mask[i] = ok
+        kept += ok
+    return kept
+
+
+# Compiled box filter for host-side boxes; without numba the vectorized mask is used instead
+_filter_boxes_nb = njit(cache=True, fastmath=True, boundscheck=False)(_filter_boxes) if njit is not None else None
+
 
 class ImprovedMultiPersonDetector:
     """
@@ -16,33 +60,37 @@ class ImprovedMultiPersonDetector:
     """
     
     def __init__(self):
-        self._custom_model = None
-        self._yolo_model = None
         self._model_loaded = False
-        self._debug_mode = True
+        # MULTI_PERSON_DEBUG=1 logs per-frame detection details at DEBUG level
+        self._debug_mode = os.environ.get('MULTI_PERSON_DEBUG') == '1'
+        if self._debug_mode:
+            logger.setLevel(logging.DEBUG)
+        # Decodes the next frames of a batch while the model runs on the current one
+        self._decode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="person-decode")
+        self._load_models()
     
     def _load_models(self):
-        """Load both custom and fallback models"""
+        """Load the custom model, or the YOLOv8n fallback if it is unavailable"""
         if YOLO is None:
-            print("⚠️ YOLO not available")
+            logger.warning("YOLO not available")
             return False
         
         # Try to load custom model
         try:
-            self._custom_model = YOLO(os.path.join(os.path.dirname(__file__), '..', 'models', 'crowdhuman_custom.pt'))
-            print("✓ Loaded custom CrowdHuman model")
+            registry.get('crowdhuman_custom')
+            logger.info("Loaded custom CrowdHuman model")
+            self._model_loaded = True
+            return True
         except Exception as e:
-            print(f"⚠️ Could not load custom model: {e}")
-            self._custom_model = None
+            logger.warning("Could not load custom model: %s", e)
         
-        # Load YOLOv8n as fallback
+        # Load YOLOv8n as fallback, only when the custom model is unavailable
         try:
-            self._yolo_model = YOLO('yolov8n.pt')
-            print("✓ Loaded YOLOv8n fallback model")
+            registry.get('yolov8n')
+            logger.info("Loaded YOLOv8n fallback model")
             self._model_loaded = True
         except Exception as e:
-            print(f"✗ Could not load fallback model: {e}")
-            self._yolo_model = None
+            logger.error("Could not load fallback model: %s", e)
         
         return self._model_loaded
     
@@ -52,71 +100,88 @@ class ImprovedMultiPersonDetector:
             self._load_models()
         
         # Prefer your custom trained CrowdHuman model
-        if self._custom_model is not None:
-            return self._custom_model, "CrowdHuman Custom"
-        elif self._yolo_model is not None:
-            return self._yolo_model, "YOLOv8n Fallback"
-        else:
-            return None, "None"
+        for name, model_type in (("crowdhuman_custom", "CrowdHuman Custom"), ("yolov8n", "YOLOv8n Fallback")):
+            try:
+                return registry.get(name), model_type
+            except Exception:
+                continue
+        return None, "None"
     
-    def _bytes_to_numpy(self, image_bytes: bytes) -> Optional[np.ndarray]:
-        """Convert image bytes to numpy array"""
-        try:
-            img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            return np.array(img)
-        except Exception as e:
-            if self._debug_mode:
-                print(f"Error converting image: {e}")
-            return None
+    def _bytes_to_numpy(self, image: Union[bytes, np.ndarray]) -> Optional[np.ndarray]:
+        """Convert image bytes to a BGR numpy array, the order Ultralytics expects for arrays;
+        decoded BGR frames pass through"""
+        if isinstance(image, np.ndarray):
+            return image
+        frame = decode_image(image)
+        if frame is None:
+            logger.debug("Error converting image: could not decode")
+        return frame
+    
+    @staticmethod
+    def _person_mask(boxes, img_shape):
+        """Boolean keep-mask over xyxy boxes; works on NumPy arrays and on torch tensors in place on their device"""
+        height, width = img_shape[:2]
+        det_width = boxes[:, 2] - boxes[:, 0]
+        det_height = boxes[:, 3] - boxes[:, 1]
+        aspect_ratio = det_height / det_width.clip(min=1e-6)
+        center_x = (boxes[:, 0] + boxes[:, 2]) * 0.5
+        center_y = (boxes[:, 1] + boxes[:, 3]) * 0.5
+        margin = 0.02  # Relaxed to 2%
+        return (
+            # Basic size filtering (relaxed small filter, too large)
+            (det_width >= 12) & (det_height >= 24)
+            & (det_width <= width * 0.95) & (det_height <= height * 0.95)
+            # Aspect ratio filtering for persons (should be taller than wide)
+            & (aspect_ratio >= 0.8) & (aspect_ratio <= 6.0)
+            # Skip detections too close to edges (might be partial)
+            & (center_x >= width * margin) & (center_x <= width * (1 - margin))
+            & (center_y >= height * margin) & (center_y <= height * (1 - margin))
+        )
     
     def _filter_person_detections(self, boxes, confidences, img_shape) -> List[Dict]:
         """Filter and validate person detections"""
         if boxes is None or len(boxes) == 0:
             return []
         
-        height, width = img_shape[:2]
-        valid_detections = []
-        
-        for i, (box, conf) in enumerate(zip(boxes, confidences)):
-            x1, y1, x2, y2 = box
-            det_width = x2 - x1
-            det_height = y2 - y1
-            
-            # Basic size filtering
-            if det_width < 12 or det_height < 24:  # Relaxed small filter
-                continue
-            
-            if det_width > width * 0.95 or det_height > height * 0.95:  # Too large
-                continue
-            
-            # Aspect ratio filtering for persons (should be taller than wide)
-            aspect_ratio = det_height / det_width if det_width > 0 else 0
-            if aspect_ratio < 0.8 or aspect_ratio > 6.0:  # Relaxed aspect range
-                continue
-            
-            # Position filtering (person shouldn't be at very edge)
-            center_x = (x1 + x2) / 2
-            center_y = (y1 + y2) / 2
-            
-            # Skip detections too close to edges (might be partial)
-            margin = 0.02  # Relaxed to 2%
-            if (center_x < width * margin or center_x > width * (1 - margin) or
-                center_y < height * margin or center_y > height * (1 - margin)):
-                continue
-            
-            valid_detections.append({
-                "person_id": len(valid_detections) + 1,
-                "bbox": {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)},
-                "center": {"x": float(center_x), "y": float(center_y)},
-                "size": {"width": float(det_width), "height": float(det_height)},
-                "confidence": float(conf),
-                "aspect_ratio": float(aspect_ratio)
-            })
+        on_device = hasattr(boxes, 'device') and boxes.device.type != 'cpu'
+        if on_device or _filter_boxes_nb is None:
+            mask = self._person_mask(boxes, img_shape)
+        else:
+            if hasattr(boxes, 'cpu'):
+                # CPU tensors share memory with their NumPy view
+                boxes = boxes.numpy()
+                confidences = confidences.numpy()
+            boxes = np.ascontiguousarray(boxes, dtype=np.float32)
+            mask = np.empty(len(boxes), dtype=np.bool_)
+            height, width = img_shape[:2]
+            _filter_boxes_nb(boxes, float(width), float(height), mask)
+        boxes = boxes[mask]
+        confidences = confidences[mask]
+        if hasattr(boxes, 'cpu'):
+            # One device-to-host copy of just the kept boxes
+            boxes = boxes.cpu().numpy()
+            confidences = confidences.cpu().numpy()
         
-        return valid_detections
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        det_width = x2 - x1
+        det_height = y2 - y1
+        aspect_ratio = det_height / det_width
+        center_x = (x1 + x2) * 0.5
+        center_y = (y1 + y2) * 0.5
+        return [
+            {
+                "person_id": i + 1,
+                "bbox": {"x1": float(x1[i]), "y1": float(y1[i]), "x2": float(x2[i]), "y2": float(y2[i])},
+                "center": {"x": float(center_x[i]), "y": float(center_y[i])},
+                "size": {"width": float(det_width[i]), "height": float(det_height[i])},
+                "confidence": float(confidences[i]),
+                "aspect_ratio": float(aspect_ratio[i])
+            }
+            for i in range(len(boxes))
+        ]
     
-    def detect_persons(self, image_bytes: bytes) -> Dict:
-        """Detect persons in image with improved accuracy"""
+    def detect_persons(self, image: Union[bytes, np.ndarray]) -> Dict:
+        """Detect persons in image bytes or a decoded frame with improved accuracy"""
         model, model_type = self._get_best_model()
         
         if model is None:
@@ -129,7 +194,7 @@ class ImprovedMultiPersonDetector:
                 "people_locations": []
             }
         
-        frame = self._bytes_to_numpy(image_bytes)
+        frame = self._bytes_to_numpy(image)
         if frame is None:
             return {
                 "num_people": 0,
@@ -148,14 +213,16 @@ class ImprovedMultiPersonDetector:
                 conf_threshold = 0.25
             
             if self._debug_mode:
-                print(f"Using {model_type} model with confidence threshold {conf_threshold}")
+                logger.debug("Using %s model with confidence threshold %s", model_type, conf_threshold)
             
             # Run inference
             results = model.predict(
-                source=frame,
+                source=np.ascontiguousarray(frame),  # letterboxing copies non-contiguous input
                 classes=[0],  # Only person class
                 conf=conf_threshold,
                 iou=0.4,  # NMS IoU threshold
+                imgsz=IMGSZ,
+                half=_HALF,
                 verbose=False,
                 save=False
             )
@@ -173,13 +240,14 @@ class ImprovedMultiPersonDetector:
             raw_detections = len(r.boxes) if r.boxes is not None else 0
             
             if self._debug_mode:
-                print(f"Raw detections from {model_type}: {raw_detections}")
+                logger.debug("Raw detections from %s: %d", model_type, raw_detections)
             
             # Filter detections
             people_locations = []
             if r.boxes is not None and len(r.boxes) > 0:
-                boxes = r.boxes.xyxy.cpu().numpy()
-                confidences = r.boxes.conf.cpu().numpy()
+                # Filtered on the model's device; only the kept boxes are copied back
+                boxes = r.boxes.xyxy
+                confidences = r.boxes.conf
                 
                 people_locations = self._filter_person_detections(
                     boxes, confidences, frame.shape
@@ -190,10 +258,7 @@ class ImprovedMultiPersonDetector:
             violation = num_people > 1
             
             if self._debug_mode:
-                print(f"Final detections after filtering: {num_people}")
-                if num_people > 0:
-                    print(f"Max confidence: {max_conf:.3f}")
-                    print(f"Violation detected: {violation}")
+                logger.debug("Final detections after filtering: %d (max confidence %.3f, violation %s)", num_people, max_conf, violation)
             
             return {
                 "num_people": num_people,
@@ -211,8 +276,7 @@ class ImprovedMultiPersonDetector:
             
         except Exception as e:
             error_msg = str(e)
-            if self._debug_mode:
-                print(f"Error in {model_type} detection: {error_msg}")
+            logger.warning("Error in %s detection: %s", model_type, error_msg)
             
             return {
                 "num_people": 0,
@@ -223,6 +287,16 @@ class ImprovedMultiPersonDetector:
                 "people_locations": []
             }
 
+    def detect_persons_batch(self, images: List[Union[bytes, np.ndarray]]) -> List[Dict]:
+        """detect_persons over several frames, with decoding overlapped with inference"""
+        decoded = [self._decode_pool.submit(self._bytes_to_numpy, image) for image in images]
+        results = []
+        for image, future in zip(images, decoded):
+            frame = future.result()
+            # A frame that failed to decode goes through as-is and gets the usual error result
+            results.append(self.detect_persons(frame if frame is not None else image))
+        return results
+
 
 # Global detector instance
 _detector = None
@@ -234,7 +308,22 @@ def get_detector() -> ImprovedMultiPersonDetector:
         _detector = ImprovedMultiPersonDetector()
     return _detector
 
-def infer_multi_person_improved(image_bytes: bytes) -> Dict:
+@cached_by_content
+def infer_multi_person_improved(image: Union[bytes, np.ndarray]) -> Dict:
     """Improved multi-person detection function"""
     detector = get_detector()
-    return detector.detect_persons(image_bytes)
+    return detector.detect_persons(image)
+
+
+def infer_multi_person_improved_batch(images: List[Union[bytes, np.ndarray]]) -> List[Dict]:
+    """Batched infer_multi_person_improved; frames already in its result cache are not re-run"""
+    cache = infer_multi_person_improved.cache
+    keys = [cache.key(image) for image in images]
+    results = [cache.get(key) for key in keys]
+    pending = [i for i, res in enumerate(results) if res is None]
+    if pending:
+        fresh = get_detector().detect_persons_batch([images[i] for i in pending])
+        for i, res in zip(pending, fresh):
+            results[i] = res
+            cache.put(keys[i], res)
+    return results
@@ -11,21 +11,15 @@ try:
 except Exception:
     np = None
 
-try:
-    from ultralytics import YOLO
-except Exception:  # pragma: no cover
-    YOLO = None
-
-
-_yolo = None
+from ._model_registry import registry
 
 
 def _get_model():
-    global _yolo
-    if _yolo is None and YOLO is not None:
-        # nano model is small and CPU-friendly
-        _yolo = YOLO('yolov8n.pt')
-    return _yolo
+    try:
+        # nano model is small and CPU-friendly; shared with the improved detector
+        return registry.get('yolov8n')
+    except Exception:
+        return None
 
 
 def _bytes_to_numpy(image_bytes: bytes):
@@ -1,7 +1,13 @@
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 import base64
+import datetime
 import io
+import importlib.util
+import logging
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 import numpy as np
 from PIL import Image
 
@@ -9,10 +15,112 @@ try:
     from ultralytics import YOLO
 except ImportError:
     YOLO = None
+try:
+    import torch
+except ImportError:
+    torch = None
+try:
+    # Installed alongside ultralytics; runs NMS as one kernel on the boxes' device
+    from torchvision.ops import nms
+except ImportError:
+    nms = None
+
+# Half precision on CUDA (tensor cores, half the activation bandwidth); CPU stays FP32
+_HALF = torch is not None and torch.cuda.is_available()
+# On CUDA hosts with TensorRT installed, each .pt is exported once to a sibling .engine and served from that
+_TENSORRT = _HALF and importlib.util.find_spec('tensorrt') is not None
+
+if _HALF:
+    # Input shapes are fixed (IMGSZ), so cuDNN's per-shape autotuning is paid once
+    torch.backends.cudnn.benchmark = True
+
+
+logger = logging.getLogger(__name__)
+# EDI_LOG_LEVEL=DEBUG shows the per-frame messages; otherwise the root configuration applies
+if os.environ.get('EDI_LOG_LEVEL'):
+    logger.setLevel(os.environ['EDI_LOG_LEVEL'].upper())
+
+
+def _nms_numpy(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy NMS over (N, 4) xyxy boxes, vectorized per kept box; indices in descending score"""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    # Stable descending order: equal scores keep detection order, as the old sorted(reverse=True) did
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        # IoU of the current box against every remaining box at once
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = w * h
+        union = areas[i] + areas[rest] - inter
+        iou = np.where(union > 0, inter / np.maximum(union, 1e-12), 0.0)
+        order = rest[iou < iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
 
 # Import existing modules
 from .head_pose import infer_head_pose
 from .body_visibility import infer_body_visibility
+from .frame_context import build_frame_context
+from ._jpeg import decode_jpeg_scaled
+from ._nms_numba import nms_kernel
+
+# Candidate weight locations, tried in order; relative entries resolve against the working directory
+_HERE = Path(__file__).resolve().parent
+CUSTOM_MODEL_PATHS = (
+    Path('models', 'crowdhuman_custom.pt'),
+    _HERE.parent / 'models' / 'crowdhuman_custom.pt',
+    _HERE.parents[1] / 'models' / 'crowdhuman_custom.pt',
+    _HERE.parents[1] / 'ml' / 'training_results_light' / 'crowdhuman_light_20250911_114753' / 'weights' / 'best.pt',
+)
+FALLBACK_MODEL_PATHS = (
+    Path('yolov8n.pt'),
+    _HERE.parent / 'yolov8n.pt',
+    _HERE.parents[1] / 'yolov8n.pt',
+)
+
+
+def _first_existing(paths) -> Optional[str]:
+    for path in paths:
+        if path.exists():
+            return str(path)
+    return None
+
+
+def _to_numpy(image):
+    """Frames given as torch tensors become host HWC uint8 arrays; bytes and arrays pass through.
+
+    CHW tensors are transposed and float tensors in [0, 1] are scaled to 0-255.
+    """
+    if torch is None or not isinstance(image, torch.Tensor):
+        return image
+    image = image.detach()
+    if image.ndim == 3 and image.shape[0] in (1, 3) and image.shape[-1] not in (1, 3):
+        image = image.permute(1, 2, 0)
+    if image.is_floating_point():
+        image = (image * 255).clamp(0, 255).to(torch.uint8)
+    return np.ascontiguousarray(image.cpu().numpy())
+
+
+def _on_own_stream(fn, *args, **kwargs):
+    """Call fn on a dedicated CUDA stream so its kernels can overlap other work on the GPU"""
+    if torch is None or not torch.cuda.is_available():
+        return fn(*args, **kwargs)
+    stream = torch.cuda.Stream()
+    with torch.cuda.stream(stream):
+        result = fn(*args, **kwargs)
+    stream.synchronize()
+    return result
+
+
+def _done(result) -> Future:
+    """Already-completed future, so skipped detectors read the same way as submitted ones"""
+    future = Future()
+    future.set_result(result)
+    return future
 
 class UnifiedDetectionSystem:
     """
@@ -22,36 +130,79 @@ class UnifiedDetectionSystem:
     3. Body visibility detection
     """
     
+    # Frames per model.predict call in detect_multiple_persons_batch
+    MAX_BATCH = 16
+    # Fixed inference size, so every call letterboxes to the same input shape
+    IMGSZ = 640
+    # Encoded frames larger than the inference size are reduced to about this size while decoding
+    DECODE_MAX_SIDE = IMGSZ
+    # Minimum person confidence, for both the custom and the fallback model
+    CONF_THRESHOLD = 0.25
+    
     def __init__(self):
         self._custom_model = None
         self._fallback_model = None
+        # Resolved weight paths; None until probed ('' means no local fallback file)
+        self._custom_model_path: Optional[str] = None
+        self._fallback_model_path: Optional[str] = None
         self._model_loaded = False
         self._last_error = None
+        self._decode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="unified-decode")
+        # One worker per sub-detector in unified_inference
+        self._exec = ThreadPoolExecutor(max_workers=3, thread_name_prefix="unified-detect")
+    
+    def _load_model(self, path: str):
+        """YOLO model for path, served from a cached TensorRT engine when available, and warmed up"""
+        model = None
+        engine_path = os.path.splitext(path)[0] + '.engine'
+        if _TENSORRT or (_HALF and os.path.exists(engine_path)):
+            try:
+                if not os.path.exists(engine_path):
+                    # Dynamic batch up to MAX_BATCH; a static engine only accepts one frame per predict
+                    engine_path = YOLO(path).export(format='engine', half=True, imgsz=self.IMGSZ,
+                                                    batch=self.MAX_BATCH, dynamic=True)
+                # Engines are already fused and fixed to FP16
+                model = YOLO(engine_path, task='detect')
+            except Exception as e:
+                logger.warning("TensorRT engine unavailable for %s, using PyTorch: %s", path, e)
+        if model is None:
+            model = self._prepare_model(YOLO(path))
+        # Fixed predict arguments are set once here rather than passed on every call
+        model.overrides.update({'classes': [0], 'conf': self.CONF_THRESHOLD, 'imgsz': self.IMGSZ, 'half': _HALF, 'verbose': False})
+        # Two passes at the serving shape so backend setup and kernel autotuning are done before traffic
+        warmup = np.zeros((self.IMGSZ, self.IMGSZ, 3), dtype=np.uint8)
+        for _ in range(2):
+            model.predict(source=warmup)
+        return model
+    
+    @staticmethod
+    def _prepare_model(model):
+        """Fuse Conv+BN once after loading; FP16 itself is requested per predict call"""
+        try:
+            model.fuse()
+        except Exception as e:
+            logger.warning("Could not fuse model layers: %s", e)
+        return model
     
     def _get_custom_model(self):
         """Load custom CrowdHuman model with fallback"""
         if self._custom_model is None and YOLO is not None:
             try:
                 # Try to load custom trained model from multiple possible locations
-                model_paths = [
-                    'models/crowdhuman_custom.pt',
-                    os.path.join(os.path.dirname(__file__), '..', 'models', 'crowdhuman_custom.pt'),
-                    os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'crowdhuman_custom.pt'),
-                    os.path.join(os.path.dirname(__file__), '..', '..', 'ml', 'training_results_light', 'crowdhuman_light_20250911_114753', 'weights', 'best.pt')
-                ]
-                
-                for path in model_paths:
-                    if os.path.exists(path):
-                        self._custom_model = YOLO(path)
-                        print(f"✓ Loaded custom CrowdHuman model from {path}")
-                        self._model_loaded = True
-                        return self._custom_model
+                if self._custom_model_path is None:
+                    self._custom_model_path = _first_existing(CUSTOM_MODEL_PATHS)
+                if self._custom_model_path is not None:
+                    path = self._custom_model_path
+                    self._custom_model = self._load_model(path)
+                    logger.info("Loaded custom CrowdHuman model from %s", path)
+                    self._model_loaded = True
+                    return self._custom_model
                 
-                print("⚠ Could not find custom model in any expected location")
+                logger.warning("Could not find custom model in any expected location")
                 self._custom_model = False
                 self._last_error = "Model file not found in any expected location"
             except Exception as e:
-                print(f"⚠ Could not load custom model: {e}")
+                logger.warning("Could not load custom model: %s", e)
                 self._custom_model = False
                 self._last_error = str(e)
         
@@ -59,113 +210,175 @@ class UnifiedDetectionSystem:
         if self._custom_model is False or self._custom_model is None:
             if self._fallback_model is None and YOLO is not None:
                 try:
-                    # Try multiple possible locations for fallback model
-                    fallback_paths = [
-                        'yolov8n.pt',
-                        os.path.join(os.path.dirname(__file__), '..', 'yolov8n.pt'),
-                        os.path.join(os.path.dirname(__file__), '..', '..', 'yolov8n.pt')
-                    ]
-                    
-                    for path in fallback_paths:
-                        if os.path.exists(path):
-                            self._fallback_model = YOLO(path)
-                            print(f"✓ Loaded fallback YOLOv8n model from {path}")
-                            self._model_loaded = True
-                            return self._fallback_model
+                    # Try multiple possible locations for fallback model; the probe result is kept for retries
+                    if self._fallback_model_path is None:
+                        self._fallback_model_path = _first_existing(FALLBACK_MODEL_PATHS) or ''
+                    if self._fallback_model_path:
+                        path = self._fallback_model_path
+                        self._fallback_model = self._load_model(path)
+                        logger.info("Loaded fallback YOLOv8n model from %s", path)
+                        self._model_loaded = True
+                        return self._fallback_model
                     
                     # If no local file found, try to download from ultralytics
-                    self._fallback_model = YOLO('yolov8n.pt')
-                    print("✓ Downloaded fallback YOLOv8n model")
+                    self._fallback_model = self._load_model('yolov8n.pt')
+                    logger.info("Downloaded fallback YOLOv8n model")
                     self._model_loaded = True
                     return self._fallback_model
                 except Exception as e:
-                    print(f"✗ Could not load fallback model: {e}")
+                    logger.error("Could not load fallback model: %s", e)
                     self._last_error = str(e)
                     return None
             return self._fallback_model
         
         return self._custom_model
     
-    def _bytes_to_numpy(self, image_bytes: bytes) -> Optional[np.ndarray]:
-        """Convert image bytes to numpy array"""
+    def _decode_frame(self, image: Union[bytes, np.ndarray, "torch.Tensor"]) -> Tuple[Optional[np.ndarray], float]:
+        """Decode image bytes to a BGR array (the order Ultralytics expects for arrays), returning it with
+        the factor that maps its coordinates back to the original image; decoded BGR frames (arrays,
+        tensors) pass through at scale 1"""
+        image = _to_numpy(image)
+        if isinstance(image, np.ndarray):
+            return image, 1.0
+        # libjpeg-turbo's SIMD decoder first; PIL handles PNG/WebP and hosts without PyTurboJPEG
+        decoded = decode_jpeg_scaled(image, self.DECODE_MAX_SIDE)
+        if decoded is not None:
+            return decoded
         try:
-            img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            return np.array(img)
+            img = Image.open(io.BytesIO(image))
+            width, height = img.size
+            ratio = self.DECODE_MAX_SIDE / max(width, height)
+            if ratio < 1.0:
+                # Let libjpeg downscale by 1/2, 1/4 or 1/8 during the IDCT; YOLO would shrink
+                # the frame to DECODE_MAX_SIDE anyway
+                img.draft('RGB', (int(width * ratio), int(height * ratio)))
+            img = img.convert('RGB')
+            return np.ascontiguousarray(np.asarray(img)[:, :, ::-1]), width / img.width
         except Exception as e:
-            print(f"Error converting image: {e}")
-            return None
+            logger.debug("Error converting image: %s", e)
+            return None, 1.0
     
-    def _calculate_iou(self, box1: Dict, box2: Dict) -> float:
-        """Calculate Intersection over Union (IoU) between two bounding boxes"""
-        # Extract coordinates
-        x1_1, y1_1, x2_1, y2_1 = box1["bbox"]["x1"], box1["bbox"]["y1"], box1["bbox"]["x2"], box1["bbox"]["y2"]
-        x1_2, y1_2, x2_2, y2_2 = box2["bbox"]["x1"], box2["bbox"]["y1"], box2["bbox"]["x2"], box2["bbox"]["y2"]
-        
-        # Calculate intersection area
-        x1_inter = max(x1_1, x1_2)
-        y1_inter = max(y1_1, y1_2)
-        x2_inter = min(x2_1, x2_2)
-        y2_inter = min(y2_1, y2_2)
-        
-        if x2_inter <= x1_inter or y2_inter <= y1_inter:
-            return 0.0
-        
-        inter_area = (x2_inter - x1_inter) * (y2_inter - y1_inter)
-        
-        # Calculate union area
-        box1_area = (x2_1 - x1_1) * (y2_1 - y1_1)
-        box2_area = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union_area = box1_area + box2_area - inter_area
-        
-        return inter_area / union_area if union_area > 0 else 0.0
+    @staticmethod
+    def _to_locations(rows: List[List[float]], scale: float = 1.0, compact: bool = False) -> List[Dict]:
+        """Person dicts for already-filtered host-side [x1, y1, x2, y2, conf] rows, numbered in order;
+        coordinates are multiplied by scale to map them back to the original image.
+        compact gives one flat dict per person (person_id, x1, y1, x2, y2, cx, cy, confidence)."""
+        if compact:
+            if scale != 1.0:
+                rows = [(x1 * scale, y1 * scale, x2 * scale, y2 * scale, conf) for x1, y1, x2, y2, conf in rows]
+            return [
+                {"person_id": i + 1, "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                 "cx": (x1 + x2) / 2, "cy": (y1 + y2) / 2, "confidence": conf}
+                for i, (x1, y1, x2, y2, conf) in enumerate(rows)
+            ]
+        locations = []
+        for i, (x1, y1, x2, y2, conf) in enumerate(rows):
+            if scale != 1.0:
+                x1, y1, x2, y2 = x1 * scale, y1 * scale, x2 * scale, y2 * scale
+            width = x2 - x1
+            height = y2 - y1
+            locations.append({
+                "person_id": i + 1,
+                "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+                "center": {"x": (x1 + x2) / 2, "y": (y1 + y2) / 2},
+                "size": {"width": width, "height": height},
+                "confidence": conf,
+                "aspect_ratio": height / width
+            })
+        return locations
     
-    def _apply_custom_nms(self, detections: List[Dict], iou_threshold: float = 0.5) -> List[Dict]:
-        """Apply Non-Maximum Suppression to remove overlapping detections"""
-        if not detections:
-            return []
-        
-        # Sort detections by confidence (highest first)
-        sorted_detections = sorted(detections, key=lambda x: x["confidence"], reverse=True)
-        
-        keep = []
-        while sorted_detections:
-            # Take the detection with highest confidence
-            current = sorted_detections.pop(0)
-            keep.append(current)
+    def _person_result(self, r, using_custom: bool, conf_threshold: float, scale: float = 1.0, compact: bool = False) -> Dict:
+        """Filter one YOLO result into the multi-person response dict"""
+        people_locations = []
+        max_conf = 0.0
+        if r.boxes is not None and len(r.boxes) > 0:
+            # Filtering and NMS run on the model's device; only the kept rows are copied back
+            boxes = r.boxes.xyxy  # x1, y1, x2, y2
+            confidences = r.boxes.conf
+            width = boxes[:, 2] - boxes[:, 0]
+            height = boxes[:, 3] - boxes[:, 1]
+            aspect_ratio = height / width.clamp(min=1e-6)
             
-            # Remove detections that have high IoU with current detection
-            remaining = []
-            for detection in sorted_detections:
-                iou = self._calculate_iou(current, detection)
-                if iou < iou_threshold:
-                    remaining.append(detection)
+            # Filter out detections that are too small or have wrong aspect ratio
+            # (relaxed limits; a typical person is taller than wide) or very low confidence
+            mask = (
+                (width >= 10) & (height >= 20)
+                & (aspect_ratio >= 0.8) & (aspect_ratio <= 6.0)
+                & (confidences >= conf_threshold)
+            )
+            boxes = boxes[mask]
+            confidences = confidences[mask]
+            
+            # Remove overlapping detections; kept indices come back in descending confidence
+            if nms is not None:
+                keep = nms(boxes, confidences, 0.5)
+                # One device-to-host transfer: kept boxes and scores packed as (K, 5) rows
+                rows = torch.cat((boxes[keep], confidences[keep, None]), dim=1).tolist()
+            else:
+                boxes = boxes.cpu().numpy()
+                confidences = confidences.cpu().numpy()
+                # Without torchvision: the parallel numba kernel if available, else the numpy loop
+                keep = (nms_kernel or _nms_numpy)(boxes, confidences, 0.5)
+                rows = np.column_stack((boxes[keep], confidences[keep])).tolist()
             
-            sorted_detections = remaining
+            people_locations = self._to_locations(rows, scale, compact)
+            # Rows are in NMS order, so the first one carries the highest confidence
+            if rows:
+                max_conf = rows[0][4]
         
-        # Reassign person IDs
-        for i, detection in enumerate(keep):
-            detection["person_id"] = i + 1
+        num_people = len(people_locations)
+        violation = num_people > 1
         
-        return keep
+        # Add debug information
+        debug_info = {
+            "confidence_threshold": conf_threshold,
+            "raw_detections": len(r.boxes) if r.boxes is not None else 0,
+            "filtered_detections": num_people,
+            "model_used": "CrowdHuman Custom" if using_custom else "YOLOv8n Fallback"
+        }
+        
+        return {
+            "num_people": num_people,
+            "confidence": max_conf,
+            "violation": violation,
+            "using_custom": using_custom,
+            "model_type": "CrowdHuman Custom" if using_custom else "YOLOv8n Fallback",
+            "people_locations": people_locations,
+            "debug_info": debug_info
+        }
     
-    def detect_multiple_persons(self, image_bytes: bytes) -> Dict:
+    def detect_multiple_persons(self, image: Union[bytes, np.ndarray, "torch.Tensor"], compact: bool = False) -> Dict:
         """Enhanced multi-person detection using custom CrowdHuman model"""
+        return self.detect_multiple_persons_batch([image], compact=compact)[0]
+    
+    def detect_multiple_persons_batch(self, images: List[Union[bytes, np.ndarray, "torch.Tensor"]], compact: bool = False) -> List[Dict]:
+        """detect_multiple_persons over several frames, run through the model up to MAX_BATCH at a time.
+        compact=True returns flat people_locations entries instead of the nested bbox/center/size form."""
+        # Decode in parallel; a single frame is decoded inline
+        if len(images) > 1:
+            decoded = list(self._decode_pool.map(self._decode_frame, images))
+        else:
+            decoded = [self._decode_frame(image) for image in images]
+        return self._detect_decoded(decoded, compact)
+    
+    def _detect_decoded(self, decoded: List[Tuple[Optional[np.ndarray], float]], compact: bool = False) -> List[Dict]:
+        """Person detection on (frame, scale) pairs from _decode_frame; None frames get an error result"""
         model = self._get_custom_model()
         using_custom = (model == self._custom_model and model is not None)
         
         if model is None:
-            return {
+            return [{
                 "num_people": 0, 
                 "confidence": 0.0, 
                 "violation": False, 
                 "using_custom": False,
                 "error": f"No models available: {self._last_error}",
                 "people_locations": []
-            }
-
-        frame = self._bytes_to_numpy(image_bytes)
-        if frame is None:
-            return {
+            } for _ in decoded]
+        
+        frames = [frame for frame, _ in decoded]
+        results: List[Optional[Dict]] = [
+            None if frame is not None else {
                 "num_people": 0, 
                 "confidence": 0.0, 
                 "violation": False, 
@@ -173,207 +386,248 @@ class UnifiedDetectionSystem:
                 "error": "Could not process image",
                 "people_locations": []
             }
+            for frame in frames
+        ]
+        pending = [i for i, frame in enumerate(frames) if frame is not None]
         
-        try:
-            # Use more conservative confidence thresholds to reduce false positives
-            if using_custom:
-                conf_threshold = 0.25
-            else:
-                conf_threshold = 0.25
-            
-            results = model.predict(source=frame, classes=[0], conf=conf_threshold, verbose=False)
-            
-            if not results:
-                return {
-                    "num_people": 0, 
-                    "confidence": 0.0, 
-                    "violation": False, 
-                    "using_custom": using_custom,
-                    "people_locations": []
-                }
-
-            r = results[0]
-            
-            people_locations = []
-            if r.boxes is not None and len(r.boxes) > 0:
-                boxes = r.boxes.xyxy.cpu().numpy()  # x1, y1, x2, y2
-                confidences = r.boxes.conf.cpu().numpy()
-                
-                # Apply additional filtering to reduce false positives
-                valid_detections = []
-                
-                for i, (box, conf) in enumerate(zip(boxes, confidences)):
-                    x1, y1, x2, y2 = box
-                    width = x2 - x1
-                    height = y2 - y1
-                    
-                    # Filter out detections that are too small or have wrong aspect ratio
-                    # Typical person aspect ratio should be height > width
-                    min_width = 10  # relaxed minimum width in pixels
-                    min_height = 20  # relaxed minimum height in pixels
-                    max_aspect_ratio = 6.0  # relaxed maximum ratio
-                    min_aspect_ratio = 0.8  # relaxed minimum ratio
-                    
-                    if width < min_width or height < min_height:
-                        continue  # Skip too small detections
-                    
-                    aspect_ratio = height / width if width > 0 else 0
-                    if aspect_ratio < min_aspect_ratio or aspect_ratio > max_aspect_ratio:
-                        continue  # Skip detections with wrong aspect ratio
-                    
-                    # Skip detections with very low confidence even after initial filtering
-                    if conf < conf_threshold:
-                        continue
-                    
-                    center_x = (x1 + x2) / 2
-                    center_y = (y1 + y2) / 2
-                    
-                    detection = {
-                        "person_id": len(valid_detections) + 1,
-                        "bbox": {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)},
-                        "center": {"x": float(center_x), "y": float(center_y)},
-                        "size": {"width": float(width), "height": float(height)},
-                        "confidence": float(conf),
-                        "aspect_ratio": float(aspect_ratio)
+        # Same threshold the model's predict overrides were set with in _load_model
+        conf_threshold = self.CONF_THRESHOLD
+        
+        for start in range(0, len(pending), self.MAX_BATCH):
+            idxs = pending[start:start + self.MAX_BATCH]
+            try:
+                # Ultralytics letterboxes each frame and runs the list as one batch
+                batch_results = model.predict(source=[frames[i] for i in idxs])
+                for i, r in zip(idxs, batch_results):
+                    results[i] = self._person_result(r, using_custom, conf_threshold, decoded[i][1], compact)
+            except Exception as e:
+                for i in idxs:
+                    results[i] = {
+                        "num_people": 0, 
+                        "confidence": 0.0, 
+                        "violation": False, 
+                        "using_custom": using_custom,
+                        "error": str(e),
+                        "people_locations": []
                     }
-                    valid_detections.append(detection)
-                
-                # Apply Non-Maximum Suppression manually if needed to remove overlapping detections
-                people_locations = self._apply_custom_nms(valid_detections, iou_threshold=0.5)
-            
-            num_people = len(people_locations)
-            max_conf = max([p["confidence"] for p in people_locations]) if people_locations else 0.0
-            violation = num_people > 1
-            
-            # Add debug information
-            debug_info = {
-                "confidence_threshold": conf_threshold,
-                "raw_detections": len(r.boxes) if r.boxes is not None else 0,
-                "filtered_detections": num_people,
-                "model_used": "CrowdHuman Custom" if using_custom else "YOLOv8n Fallback"
-            }
-            
-            return {
-                "num_people": num_people,
-                "confidence": max_conf,
-                "violation": violation,
-                "using_custom": using_custom,
-                "model_type": "CrowdHuman Custom" if using_custom else "YOLOv8n Fallback",
-                "people_locations": people_locations,
-                "debug_info": debug_info
-            }
-            
-        except Exception as e:
-            return {
-                "num_people": 0, 
-                "confidence": 0.0, 
-                "violation": False, 
-                "using_custom": using_custom,
-                "error": str(e),
-                "people_locations": []
-            }
+        
+        return results
     
-    def unified_inference(self, image_bytes: bytes) -> Dict:
-        """
-        Run all detection models on the image and return combined results
-        """
-        results = {
-            "timestamp": "",
+    @staticmethod
+    def _new_results() -> Dict:
+        """Empty unified response, timestamped now"""
+        return {
+            "timestamp": datetime.datetime.now().isoformat(),
             "image_processed": True,
             "detections": {},
             "violations": {},
             "summary": {}
         }
+    
+    @staticmethod
+    def _unscale_frame_results(head_pose_result: Dict, body_visibility_result: Dict, scale: float) -> Tuple[Dict, Dict]:
+        """Map the pixel fields head pose and body visibility report on the decoded frame back to the
+        original image, matching the person boxes"""
+        if scale == 1.0:
+            return head_pose_result, body_visibility_result
+        location = head_pose_result.get("face_location")
+        if location:
+            head_pose_result = {**head_pose_result, "face_location": {k: int(round(v * scale)) for k, v in location.items()}}
+        debug_info = body_visibility_result.get("debug_info")
+        if debug_info and "image_size" in debug_info:
+            w, h = (int(v) for v in debug_info["image_size"].split("x"))
+            body_visibility_result = {
+                **body_visibility_result,
+                "debug_info": {**debug_info, "image_size": f"{int(round(w * scale))}x{int(round(h * scale))}"},
+            }
+        return head_pose_result, body_visibility_result
+    
+    @staticmethod
+    def _assemble(results: Dict, multi_person_result: Dict, head_pose_result: Dict, body_visibility_result: Dict) -> None:
+        """Fill results with the three detector outputs, the violation analysis and the summary"""
+        # 1. Multi-person detection
+        results["detections"]["multi_person"] = multi_person_result
         
-        try:
-            import datetime
-            results["timestamp"] = datetime.datetime.now().isoformat()
-            
-            # 1. Multi-person detection
-            print("Running multi-person detection...")
-            multi_person_result = self.detect_multiple_persons(image_bytes)
-            results["detections"]["multi_person"] = multi_person_result
-            
-            # 2. Head pose detection
-            print("Running head pose detection...")
-            head_pose_result = infer_head_pose(image_bytes)
-            # Normalize head pose keys so frontend always receives 'direction'
-            normalized_head_pose = dict(head_pose_result)
-            if "direction" not in normalized_head_pose:
-                if "head_pose" in normalized_head_pose:
-                    normalized_head_pose["direction"] = normalized_head_pose.get("head_pose")
-                elif "pose" in normalized_head_pose:
-                    normalized_head_pose["direction"] = normalized_head_pose.get("pose")
-            results["detections"]["head_pose"] = normalized_head_pose
-            
-            # 3. Body visibility detection
-            print("Running body visibility detection...")
-            body_visibility_result = infer_body_visibility(image_bytes)
-            results["detections"]["body_visibility"] = body_visibility_result
+        # 2. Head pose detection
+        # Normalize head pose keys so frontend always receives 'direction'
+        normalized_head_pose = dict(head_pose_result)
+        if "direction" not in normalized_head_pose:
+            if "head_pose" in normalized_head_pose:
+                normalized_head_pose["direction"] = normalized_head_pose.get("head_pose")
+            elif "pose" in normalized_head_pose:
+                normalized_head_pose["direction"] = normalized_head_pose.get("pose")
+        results["detections"]["head_pose"] = normalized_head_pose
+        
+        # 3. Body visibility detection
+        results["detections"]["body_visibility"] = body_visibility_result
 
-            # Also expose top-level keys expected by new frontend
-            results["multi_person"] = multi_person_result
-            results["head_pose"] = normalized_head_pose
-            results["body_visibility"] = body_visibility_result
-            
-            # Analyze violations
-            violations = []
-            violation_details = {}
-            
-            # Multi-person violation
-            if multi_person_result.get("violation", False):
-                violations.append("multiple_persons")
-                violation_details["multiple_persons"] = {
-                    "detected": multi_person_result.get("num_people", 0),
-                    "confidence": multi_person_result.get("confidence", 0),
-                    "locations": multi_person_result.get("people_locations", [])
-                }
-            
-            # Head pose violation
-            if head_pose_result.get("violation", False):
-                violations.append("head_pose")
-                violation_details["head_pose"] = {
-                    "direction": head_pose_result.get("direction", "unknown"),
-                    "confidence": head_pose_result.get("confidence", 0)
-                }
-            
-            # Body visibility violation
-            if body_visibility_result.get("violation", False):
-                violations.append("body_visibility")
-                violation_details["body_visibility"] = {
-                    "issue": body_visibility_result.get("visibility_status", "unknown"),
-                    "confidence": body_visibility_result.get("confidence", 0)
-                }
-            
-            results["violations"] = {
-                "has_violations": len(violations) > 0,
-                "violation_types": violations,
-                "details": violation_details,
-                "total_violations": len(violations)
+        # Also expose top-level keys expected by new frontend
+        results["multi_person"] = multi_person_result
+        results["head_pose"] = normalized_head_pose
+        results["body_visibility"] = body_visibility_result
+        
+        # Analyze violations
+        violations = []
+        violation_details = {}
+        
+        # Multi-person violation
+        if multi_person_result.get("violation", False):
+            violations.append("multiple_persons")
+            violation_details["multiple_persons"] = {
+                "detected": multi_person_result.get("num_people", 0),
+                "confidence": multi_person_result.get("confidence", 0),
+                "locations": multi_person_result.get("people_locations", [])
             }
-            
-            # Summary
-            results["summary"] = {
-                "total_people": multi_person_result.get("num_people", 0),
-                "head_direction": normalized_head_pose.get("direction", "unknown"),
-                "body_visible": not body_visibility_result.get("violation", False),
-                "overall_violation": len(violations) > 0,
-                "models_used": {
-                    "multi_person": multi_person_result.get("model_type", "unknown"),
-                    "head_pose": "MobileNetV2" if "direction" in normalized_head_pose else "unknown",
-                    "body_visibility": "Custom" if "visibility_status" in body_visibility_result else "unknown"
-                }
+        
+        # Head pose violation
+        if head_pose_result.get("violation", False):
+            violations.append("head_pose")
+            violation_details["head_pose"] = {
+                "direction": head_pose_result.get("direction", "unknown"),
+                "confidence": head_pose_result.get("confidence", 0)
             }
+        
+        # Body visibility violation
+        if body_visibility_result.get("violation", False):
+            violations.append("body_visibility")
+            violation_details["body_visibility"] = {
+                "issue": body_visibility_result.get("visibility_status", "unknown"),
+                "confidence": body_visibility_result.get("confidence", 0)
+            }
+        
+        results["violations"] = {
+            "has_violations": len(violations) > 0,
+            "violation_types": violations,
+            "details": violation_details,
+            "total_violations": len(violations)
+        }
+        
+        # Summary
+        results["summary"] = {
+            "total_people": multi_person_result.get("num_people", 0),
+            "head_direction": normalized_head_pose.get("direction", "unknown"),
+            "body_visible": not body_visibility_result.get("violation", False),
+            "overall_violation": len(violations) > 0,
+            "models_used": {
+                "multi_person": multi_person_result.get("model_type", "unknown"),
+                "head_pose": "MobileNetV2" if "direction" in normalized_head_pose else "unknown",
+                "body_visibility": "Custom" if "visibility_status" in body_visibility_result else "unknown"
+            }
+        }
+        
+        logger.debug("Unified inference completed - %d violations detected", len(violations))
+    
+    def unified_inference(self, image: Union[bytes, np.ndarray, "torch.Tensor"], user_id=None, fast_fail: bool = False) -> Dict:
+        """
+        Run all detection models on the image and return combined results.
+        The frame is decoded and face-detected once into a FrameContext shared by all detectors.
+        With fast_fail, head pose and body visibility are skipped (and marked "skipped") when
+        multi-person detection already reports a confident violation.
+        """
+        results = self._new_results()
+        
+        try:
+            # Decode once (BGR, reduced towards DECODE_MAX_SIDE); every detector works on this frame
+            # and head pose and body visibility reuse the context's face boxes. Pixel fields in
+            # their results are scaled back to the original image like the person boxes
+            frame, scale = self._decode_frame(image)
+            if frame is None:
+                # The frame is undecodable; the detectors would each retry the decode and fail
+                results["image_processed"] = False
+                results["error"] = "Could not decode image"
+                return results
+            ctx = build_frame_context(frame)
             
-            print(f"✓ Unified inference completed - {len(violations)} violations detected")
+            if fast_fail:
+                # Person count first; a confident multi-person violation already decides the frame
+                multi_person_future = self._exec.submit(_on_own_stream, self._detect_decoded, [(frame, scale)])
+                multi_person_result = multi_person_future.result()[0]
+                skip_rest = (
+                    multi_person_result.get("violation", False)
+                    and multi_person_result.get("confidence", 0) > 0.6
+                )
+            else:
+                skip_rest = False
+            
+            if skip_rest:
+                logger.debug("Multi-person violation; skipping head pose and body visibility")
+                head_pose_future = _done({"direction": "unknown", "head_pose": "unknown", "confidence": 0.0, "violation": False, "skipped": True})
+                body_visibility_future = _done({"confidence": 0.0, "violation": False, "skipped": True})
+            else:
+                # The detectors are independent, so run them concurrently; wall time is
+                # roughly the slowest of them rather than the sum
+                logger.debug("Running multi-person, head pose and body visibility detection")
+                if not fast_fail:
+                    multi_person_future = self._exec.submit(_on_own_stream, self._detect_decoded, [(frame, scale)])
+                # Faces are detected only here (overlapping the person model), so a fast-fail frame
+                # never pays for them
+                faces = ctx.faces if ctx is not None else None
+                head_pose_future = self._exec.submit(infer_head_pose, frame, faces=faces, user_id=user_id)
+                body_visibility_future = self._exec.submit(infer_body_visibility, frame, faces=faces)
+            
+            head_pose_result, body_visibility_result = self._unscale_frame_results(
+                head_pose_future.result(), body_visibility_future.result(), scale)
+            self._assemble(results, multi_person_future.result()[0], head_pose_result, body_visibility_result)
             
         except Exception as e:
-            print(f"✗ Error in unified inference: {e}")
+            logger.warning("Error in unified inference: %s", e)
             results["image_processed"] = False
             results["error"] = str(e)
         
         return results
     
+    def unified_inference_batch(self, images: List[Union[bytes, np.ndarray, "torch.Tensor"]], user_ids: Optional[List] = None) -> List[Dict]:
+        """unified_inference over several frames, one result each; person detection runs the frames
+        through the model as one batch, head pose and body visibility run per frame"""
+        if user_ids is None:
+            user_ids = [None] * len(images)
+        outputs = [self._new_results() for _ in images]
+        
+        try:
+            # Decode in parallel; a single frame is decoded inline
+            if len(images) > 1:
+                decoded = list(self._decode_pool.map(self._decode_frame, images))
+            else:
+                decoded = [self._decode_frame(image) for image in images]
+            valid = []
+            for i, (frame, _) in enumerate(decoded):
+                if frame is None:
+                    outputs[i]["image_processed"] = False
+                    outputs[i]["error"] = "Could not decode image"
+                else:
+                    valid.append(i)
+            
+            multi_person_future = self._exec.submit(_on_own_stream, self._detect_decoded, [decoded[i] for i in valid])
+            # Faces for each frame are detected here while the person batch runs
+            per_frame = []
+            for i in valid:
+                frame = decoded[i][0]
+                ctx = build_frame_context(frame)
+                faces = ctx.faces if ctx is not None else None
+                per_frame.append((
+                    self._exec.submit(infer_head_pose, frame, faces=faces, user_id=user_ids[i]),
+                    self._exec.submit(infer_body_visibility, frame, faces=faces),
+                ))
+            multi_person_results = multi_person_future.result()
+        except Exception as e:
+            logger.warning("Error in batched unified inference: %s", e)
+            for results in outputs:
+                results["image_processed"] = False
+                results.setdefault("error", str(e))
+            return outputs
+        
+        for i, multi_person_result, (head_pose_future, body_visibility_future) in zip(valid, multi_person_results, per_frame):
+            try:
+                head_pose_result, body_visibility_result = self._unscale_frame_results(
+                    head_pose_future.result(), body_visibility_future.result(), decoded[i][1])
+                self._assemble(outputs[i], multi_person_result, head_pose_result, body_visibility_result)
+            except Exception as e:
+                logger.warning("Error in unified inference: %s", e)
+                outputs[i]["image_processed"] = False
+                outputs[i]["error"] = str(e)
+        
+        return outputs
+    
     def get_model_status(self) -> Dict:
         """Get status of all models"""
         status = {
@@ -402,25 +656,38 @@ class UnifiedDetectionSystem:
 
 # Global instance
 _unified_system = None
+_unified_lock = threading.Lock()
 
 def get_unified_system() -> UnifiedDetectionSystem:
     """Get or create the unified detection system instance"""
     global _unified_system
     if _unified_system is None:
-        _unified_system = UnifiedDetectionSystem()
+        with _unified_lock:
+            if _unified_system is None:
+                _unified_system = UnifiedDetectionSystem()
     return _unified_system
 
-def infer_multi_person_unified(image_bytes: bytes) -> Dict:
+def infer_multi_person_unified(image: Union[bytes, np.ndarray, "torch.Tensor"], compact: bool = False) -> Dict:
     """Enhanced multi-person detection (backward compatible)"""
     system = get_unified_system()
-    return system.detect_multiple_persons(image_bytes)
+    return system.detect_multiple_persons(image, compact=compact)
 
-def infer_unified(image_bytes: bytes) -> Dict:
+def infer_unified(image: Union[bytes, np.ndarray, "torch.Tensor"], user_id=None, fast_fail: bool = False) -> Dict:
     """Run all detections and return unified results"""
     system = get_unified_system()
-    return system.unified_inference(image_bytes)
+    return system.unified_inference(image, user_id=user_id, fast_fail=fast_fail)
 
 def get_system_status() -> Dict:
     """Get status of the unified detection system"""
     system = get_unified_system()
     return system.get_model_status()
+
+def infer_unified_batch(images: List[Union[bytes, np.ndarray, "torch.Tensor"]], user_ids: Optional[List] = None) -> List[Dict]:
+    """Batched infer_unified, one result per frame"""
+    system = get_unified_system()
+    return system.unified_inference_batch(images, user_ids=user_ids)
+
+
+# EDI_PRELOAD=1 loads (and warms up) the person model at import, so the first request doesn't pay for it
+if os.environ.get('EDI_PRELOAD') == '1':
+    get_unified_system()._get_custom_model()
@@ -0,0 +1,38 @@
+"""
+One-off export of the Keras head-pose model to ONNX.
+
+head_pose_model serves <model>.onnx through ONNX Runtime whenever it sits next to the .h5
+(or at HEAD_POSE_ONNX_PATH). Only this script needs tensorflow and tf2onnx:
+
+    pip install tf2onnx
+    python export_head_pose_onnx.py [path/to/head_pose_mobilenet_final.h5]
+"""
+import os
+import sys
+
+import tensorflow as tf
+import tf2onnx
+
+from detections import head_pose_model as hpm
+
+
+def main():
+    model_path = sys.argv[1] if len(sys.argv) > 1 else hpm.MODEL_PATH
+    if not os.path.exists(model_path):
+        print(f"Model file not found: {model_path}")
+        sys.exit(1)
+
+    hpm.MODEL_PATH = model_path
+    hpm._load_model_info()
+    img_size = hpm._img_size
+
+    model = tf.keras.models.load_model(model_path)
+    output_path = os.path.splitext(model_path)[0] + '.onnx'
+    # Dynamic batch dimension so batched inference can use the same export
+    spec = (tf.TensorSpec((None, img_size, img_size, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=17, output_path=output_path)
+    print(f"Exported {model_path} -> {output_path} (input {img_size}x{img_size}x3)")
+
+
+if __name__ == "__main__":
+    main()
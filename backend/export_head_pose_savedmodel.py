@@ -0,0 +1,30 @@
+"""
+One-off export of the Keras head-pose model to a TensorFlow SavedModel.
+
+head_pose_model loads <model>_savedmodel/ (or HEAD_POSE_SAVEDMODEL_PATH) in preference to the .h5
+when it exists, which shortens cold start. Requires a tf.keras (Keras 2) install:
+
+    python export_head_pose_savedmodel.py [path/to/head_pose_mobilenet_final.h5]
+"""
+import os
+import sys
+
+import tensorflow as tf
+
+from detections import head_pose_model as hpm
+
+
+def main():
+    model_path = sys.argv[1] if len(sys.argv) > 1 else hpm.MODEL_PATH
+    if not os.path.exists(model_path):
+        print(f"Model file not found: {model_path}")
+        sys.exit(1)
+
+    model = tf.keras.models.load_model(model_path)
+    output_path = os.path.splitext(model_path)[0] + '_savedmodel'
+    model.save(output_path, save_format='tf')
+    print(f"Exported {model_path} -> {output_path}")
+
+
+if __name__ == "__main__":
+    main()
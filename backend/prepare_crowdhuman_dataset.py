@@ -6,13 +6,14 @@ for training custom multi-person detection models.
 """
 
 import os
-import shutil
-import random
 from pathlib import Path
-from PIL import Image, ImageDraw
+import numpy as np
 import json
 from typing import List, Dict, Tuple
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from _dataset_io import COPY_WORKERS, copy_and_write_labels, count_lines, list_files
 
 # Try to import YOLO for pseudo-labeling (optional)
 try:
@@ -33,107 +34,92 @@ def create_yolo_structure(output_dir: str):
     
     return base_path
 
-def create_pseudo_labels_with_yolo(image_path: str, is_crowd: bool) -> List[Tuple[int, float, float, float, float]]:
+# Loaded on first use and shared by every pseudo-labeling call
+_YOLO_MODEL = None
+# Images per YOLO call when pseudo-labeling
+PSEUDO_LABEL_BATCH = 32
+
+def _get_yolo():
+    """YOLOv8n model for pseudo-labeling, loaded once"""
+    global _YOLO_MODEL
+    if _YOLO_MODEL is None:
+        _YOLO_MODEL = YOLO('yolov8n.pt')
+    return _YOLO_MODEL
+
+def _pseudo_labels_from_result(result) -> List[Tuple[int, float, float, float, float]]:
+    """Confident person boxes from one YOLO result as (class_id, x_center, y_center, width, height)"""
+    labels = []
+    
+    if result.boxes is not None:
+        boxes = result.boxes
+        
+        # Person class (class 0 in COCO) with confidence > 0.5
+        keep = (boxes.cls == 0) & (boxes.conf > 0.5)
+        
+        # xywhn is already YOLO format: normalized center coordinates and dimensions
+        for x_center, y_center, width, height in boxes.xywhn[keep].tolist():
+            # Class 0 for person
+            labels.append((0, x_center, y_center, width, height))
+    
+    return labels
+
+def create_pseudo_labels_with_yolo_batch(image_paths: List[str]) -> List[List[Tuple[int, float, float, float, float]]]:
     """
-    Use pre-trained YOLO model to generate bounding box labels
-    Returns list of (class_id, x_center, y_center, width, height) in normalized coordinates
+    Use pre-trained YOLO model to generate bounding box labels for several images,
+    running them through the model PSEUDO_LABEL_BATCH at a time.
+    Returns one label list per path, in order; empty where inference failed
     """
     if not YOLO_AVAILABLE:
-        return []
+        return [[] for _ in image_paths]
     
     try:
-        # Load YOLOv8n model for pseudo-labeling
-        model = YOLO('yolov8n.pt')
-        
-        # Run inference
-        results = model(image_path, verbose=False)
-        
-        if not results:
-            return []
-        
-        result = results[0]
-        
-        # Get image dimensions
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-        
-        labels = []
-        
-        if result.boxes is not None:
-            boxes = result.boxes
-            
-            # Filter for person class (class 0 in COCO)
-            person_indices = boxes.cls == 0
-            
-            if person_indices.any():
-                person_boxes = boxes.xyxy[person_indices]
-                confidences = boxes.conf[person_indices]
-                
-                # Only keep detections with confidence > 0.5
-                high_conf_mask = confidences > 0.5
-                person_boxes = person_boxes[high_conf_mask]
-                
-                for box in person_boxes:
-                    x1, y1, x2, y2 = box.tolist()
-                    
-                    # Convert to YOLO format (normalized center coordinates and dimensions)
-                    x_center = (x1 + x2) / (2 * img_width)
-                    y_center = (y1 + y2) / (2 * img_height)
-                    width = (x2 - x1) / img_width
-                    height = (y2 - y1) / img_height
-                    
-                    # Class 0 for person
-                    labels.append((0, x_center, y_center, width, height))
-        
-        return labels
-        
+        model = _get_yolo()
     except Exception as e:
-        print(f"Error generating pseudo labels for {image_path}: {e}")
-        return []
+        print(f"Error loading YOLO model for pseudo labels: {e}")
+        return [[] for _ in image_paths]
+    
+    all_labels = []
+    for start in range(0, len(image_paths), PSEUDO_LABEL_BATCH):
+        chunk = image_paths[start:start + PSEUDO_LABEL_BATCH]
+        try:
+            results = model(chunk, verbose=False)
+            all_labels.extend(_pseudo_labels_from_result(result) for result in results)
+        except Exception as e:
+            print(f"Error generating pseudo labels for {len(chunk)} images starting at {chunk[0]}: {e}")
+            all_labels.extend([] for _ in chunk)
+    
+    return all_labels
 
-def create_simple_labels(image_path: str, is_crowd: bool) -> List[Tuple[int, float, float, float, float]]:
+def create_simple_labels_batch(count: int, is_crowd: bool, rng: np.random.Generator) -> List[List[Tuple[int, float, float, float, float]]]:
     """
-    Create simple labels based on folder classification
-    For crowd images: assume multiple people across the image
-    For non-crowd images: assume single person in center
+    Create simple labels for count images based on folder classification
+    For crowd images: 2-5 random boxes each, drawn for all images as one NumPy array and split per image
+    For non-crowd images: single person in center
     """
-    try:
-        img = Image.open(image_path)
-        width, height = img.size
-        
-        labels = []
-        
-        if is_crowd:
-            # For crowd images, create multiple dummy bounding boxes
-            # This is a simplified approach - in reality you'd want actual annotations
-            num_people = random.randint(2, 5)  # Assume 2-5 people in crowd images
-            
-            for i in range(num_people):
-                # Create random but reasonable bounding boxes
-                x_center = random.uniform(0.1, 0.9)
-                y_center = random.uniform(0.2, 0.8)
-                box_width = random.uniform(0.1, 0.3)
-                box_height = random.uniform(0.2, 0.6)
-                
-                # Ensure box stays within image bounds
-                x_center = max(box_width/2, min(1 - box_width/2, x_center))
-                y_center = max(box_height/2, min(1 - box_height/2, y_center))
-                
-                labels.append((0, x_center, y_center, box_width, box_height))
-        else:
-            # For non-crowd images, assume single person in center
-            labels.append((0, 0.5, 0.5, 0.4, 0.7))  # Centered person
-        
-        return labels
-        
-    except Exception as e:
-        print(f"Error creating simple labels for {image_path}: {e}")
+    if count == 0:
         return []
+    if not is_crowd:
+        # For non-crowd images, assume single person in center
+        return [[(0, 0.5, 0.5, 0.4, 0.7)] for _ in range(count)]
+    
+    # 2-5 people per crowd image, each box as (x_center, y_center, width, height)
+    num_people = rng.integers(2, 6, size=count)
+    boxes = rng.uniform([0.1, 0.2, 0.1, 0.2], [0.9, 0.8, 0.3, 0.6], size=(int(num_people.sum()), 4))
+    
+    # Ensure boxes stay within image bounds
+    half_size = boxes[:, 2:] / 2
+    boxes[:, :2] = np.clip(boxes[:, :2], half_size, 1 - half_size)
+    
+    return [
+        [(0, *box) for box in chunk.tolist()]
+        for chunk in np.split(boxes, np.cumsum(num_people)[:-1])
+    ]
 
-def copy_and_label_images(source_dir: str, output_dir: str, split_ratios: Dict[str, float] = None):
+def copy_and_label_images(source_dir: str, output_dir: str, split_ratios: Dict[str, float] = None, seed: int = 42):
     """
     Copy images and create corresponding label files
     """
+    rng = np.random.default_rng(seed)
     if split_ratios is None:
         split_ratios = {'train': 0.7, 'val': 0.2, 'test': 0.1}
     
@@ -142,14 +128,14 @@ def copy_and_label_images(source_dir: str, output_dir: str, split_ratios: Dict[s
     non_crowd_dir = Path(source_dir) / "non crowd"
     
     # Get all image files
-    crowd_images = list(crowd_dir.glob("*.jpg")) + list(crowd_dir.glob("*.png"))
-    non_crowd_images = list(non_crowd_dir.glob("*.jpg")) + list(non_crowd_dir.glob("*.png"))
+    crowd_images = list_files(crowd_dir, ('.jpg', '.png'))
+    non_crowd_images = list_files(non_crowd_dir, ('.jpg', '.png'))
     
     print(f"Found {len(crowd_images)} crowd images and {len(non_crowd_images)} non-crowd images")
     
     # Shuffle the datasets
-    random.shuffle(crowd_images)
-    random.shuffle(non_crowd_images)
+    rng.shuffle(crowd_images)
+    rng.shuffle(non_crowd_images)
     
     # Process each category
     for images, is_crowd in [(crowd_images, True), (non_crowd_images, False)]:
@@ -169,22 +155,17 @@ def copy_and_label_images(source_dir: str, output_dir: str, split_ratios: Dict[s
         for split_name, split_images in splits.items():
             print(f"  {split_name}: {len(split_images)} images")
             
-            for img_path in split_images:
-                # Copy image
+            # Labels for the whole split are generated here from the seeded generator, so they stay
+            # reproducible; the pool only copies files and writes the label text
+            split_labels = create_simple_labels_batch(len(split_images), is_crowd, rng)
+            jobs = []
+            for img_path, labels in zip(split_images, split_labels):
                 dest_img_path = base_path / split_name / 'images' / img_path.name
-                shutil.copy2(img_path, dest_img_path)
-                
-                # Create label file
                 label_file = base_path / split_name / 'labels' / (img_path.stem + '.txt')
-                
-                # Generate labels - use simple approach for faster processing
-                labels = create_simple_labels(str(img_path), is_crowd)
-                
-                # Write labels to file
-                with open(label_file, 'w') as f:
-                    for label in labels:
-                        class_id, x_center, y_center, width, height = label
-                        f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+                jobs.append((img_path, dest_img_path, label_file, labels))
+            
+            with ThreadPoolExecutor(max_workers=COPY_WORKERS) as ex:
+                list(ex.map(lambda job: copy_and_write_labels(*job), jobs))
 
 def create_dataset_yaml(output_dir: str):
     """Create dataset.yaml file for YOLO training"""
@@ -222,14 +203,14 @@ def create_statistics_report(output_dir: str):
         images_dir = base_path / split / 'images'
         labels_dir = base_path / split / 'labels'
         
-        image_count = len(list(images_dir.glob("*.jpg"))) + len(list(images_dir.glob("*.png")))
-        label_count = len(list(labels_dir.glob("*.txt")))
+        image_count = len(list_files(images_dir, ('.jpg', '.png')))
+        label_files = list_files(labels_dir, ('.txt',))
+        label_count = len(label_files)
         
         # Count total bounding boxes
         total_boxes = 0
-        for label_file in labels_dir.glob("*.txt"):
-            with open(label_file, 'r') as f:
-                total_boxes += len(f.readlines())
+        for label_file in label_files:
+            total_boxes += count_lines(label_file)
         
         stats[split] = {
             'images': image_count,
@@ -280,9 +261,6 @@ def main():
     
     args = parser.parse_args()
     
-    # Set random seed
-    random.seed(args.seed)
-    
     # Validate ratios
     total_ratio = args.train_ratio + args.val_ratio + args.test_ratio
     if abs(total_ratio - 1.0) > 0.001:
@@ -309,7 +287,7 @@ def main():
     
     # Copy and label images
     print("Copying images and creating labels...")
-    copy_and_label_images(args.source_dir, args.output_dir, split_ratios)
+    copy_and_label_images(args.source_dir, args.output_dir, split_ratios, args.seed)
     
     # Create dataset configuration
     print("Creating dataset configuration...")
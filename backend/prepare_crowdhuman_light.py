@@ -5,12 +5,14 @@ Optimized for systems without GPU - creates a smaller, manageable dataset
 """
 
 import os
-import shutil
 import random
 from pathlib import Path
 import json
 from typing import List, Dict, Tuple
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from _dataset_io import COPY_WORKERS, copy_and_write_labels, count_lines, list_files
 
 def create_yolo_structure(output_dir: str):
     """Create YOLO dataset directory structure"""
@@ -71,8 +73,8 @@ def copy_and_label_subset(source_dir: str, output_dir: str, max_images_per_class
     
     # Get limited number of image files for faster processing
     print("Scanning directories...")
-    crowd_images = list(crowd_dir.glob("*.jpg"))[:max_images_per_class]
-    non_crowd_images = list(non_crowd_dir.glob("*.jpg"))[:max_images_per_class]
+    crowd_images = list_files(crowd_dir, ('.jpg',), max_images_per_class)
+    non_crowd_images = list_files(non_crowd_dir, ('.jpg',), max_images_per_class)
     
     print(f"Using {len(crowd_images)} crowd images and {len(non_crowd_images)} non-crowd images")
     
@@ -100,33 +102,26 @@ def copy_and_label_subset(source_dir: str, output_dir: str, max_images_per_class
         for split_name, split_images in splits.items():
             print(f"  {split_name}: {len(split_images)} images")
             
-            for i, img_path in enumerate(split_images):
-                try:
-                    # Copy image
-                    dest_img_path = base_path / split_name / 'images' / img_path.name
-                    shutil.copy2(img_path, dest_img_path)
-                    
-                    # Create label file
-                    label_file = base_path / split_name / 'labels' / (img_path.stem + '.txt')
-                    
-                    # Generate simple labels
-                    labels = create_simple_labels(is_crowd)
-                    
-                    # Write labels to file
-                    with open(label_file, 'w') as f:
-                        for label in labels:
-                            class_id, x_center, y_center, width, height = label
-                            f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
-                    
-                    total_processed += 1
+            # Labels are generated here, in order, so the seeded random boxes stay reproducible;
+            # the pool only copies files and writes the label text
+            jobs = []
+            for img_path in split_images:
+                dest_img_path = base_path / split_name / 'images' / img_path.name
+                label_file = base_path / split_name / 'labels' / (img_path.stem + '.txt')
+                jobs.append((img_path, dest_img_path, label_file, create_simple_labels(is_crowd)))
+            
+            with ThreadPoolExecutor(max_workers=COPY_WORKERS) as ex:
+                futures = [ex.submit(copy_and_write_labels, *job) for job in jobs]
+                for i, (job, future) in enumerate(zip(jobs, futures)):
+                    try:
+                        future.result()
+                        total_processed += 1
+                    except Exception as e:
+                        print(f"    Error processing {job[0].name}: {e}")
                     
                     # Progress indicator every 100 images
                     if (i + 1) % 100 == 0:
                         print(f"    Processed {i + 1}/{len(split_images)} images")
-                        
-                except Exception as e:
-                    print(f"    Error processing {img_path.name}: {e}")
-                    continue
     
     print(f"Total images processed: {total_processed}")
     return total_processed
@@ -166,15 +161,15 @@ def create_statistics_report(output_dir: str):
         images_dir = base_path / split / 'images'
         labels_dir = base_path / split / 'labels'
         
-        image_count = len(list(images_dir.glob("*.jpg")))
-        label_count = len(list(labels_dir.glob("*.txt")))
+        image_count = len(list_files(images_dir, ('.jpg',)))
+        label_files = list_files(labels_dir, ('.txt',))
+        label_count = len(label_files)
         
         # Count total bounding boxes
         total_boxes = 0
         try:
-            for label_file in labels_dir.glob("*.txt"):
-                with open(label_file, 'r') as f:
-                    total_boxes += len([line for line in f if line.strip()])
+            for label_file in label_files:
+                total_boxes += count_lines(label_file)
         except Exception as e:
             print(f"Warning: Could not count boxes in {split}: {e}")
         
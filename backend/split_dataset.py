@@ -2,10 +2,13 @@ import os
 import shutil
 from sklearn.model_selection import train_test_split
 import glob
+from concurrent.futures import ThreadPoolExecutor
 
 # Dataset paths
 dataset_root = "../CrowdHuman Cropped/Dataset CrowdHuman"
 classes = ['crowd', 'non crowd']
+# Moves are a rename on the same filesystem and a full copy across mounts; both release the GIL
+MOVE_WORKERS = 16
 
 # Create train/val dirs
 for split in ['train', 'val']:
@@ -22,10 +25,11 @@ for cls in classes:
     
     train_imgs, val_imgs = train_test_split(images, test_size=0.2, random_state=42)
     
-    for img in train_imgs:
-        shutil.move(img, os.path.join(dataset_root, 'train', cls, os.path.basename(img)))
-    for img in val_imgs:
-        shutil.move(img, os.path.join(dataset_root, 'val', cls, os.path.basename(img)))
+    moves = [(img, os.path.join(dataset_root, 'train', cls, os.path.basename(img))) for img in train_imgs]
+    moves += [(img, os.path.join(dataset_root, 'val', cls, os.path.basename(img))) for img in val_imgs]
+    with ThreadPoolExecutor(max_workers=MOVE_WORKERS) as ex:
+        # list() re-raises the first failed move, as the sequential loop did
+        list(ex.map(lambda move: shutil.move(*move), moves))
     
     print(f"Split {cls}: {len(train_imgs)} train, {len(val_imgs)} val")
 
@@ -0,0 +1,8 @@
+"""WSGI entry point for production servers.
+
+Run with:
+    gunicorn -k gthread --threads 8 -w 2 -b 0.0.0.0:5000 wsgi:application
+"""
+from app import create_app
+
+application = create_app()